@@ -1,3 +1,4 @@
+from . import aligners
 from . import constants
 from . import datatypes
 from . import evaluators
@@ -7,4 +8,6 @@ from . import logwriters
 from . import parsers
 from . import plotting
 from . import printing
+from . import regression
 from . import stats_helper
+from . import sweeps
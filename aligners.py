@@ -0,0 +1,177 @@
+# -*- coding: utf-8 -*-
+
+import numpy as np
+import pandas as pan
+
+import constants as co
+
+
+class LogAligner(object):
+    '''Joins time-indexed logs, e.g. from logreaders.PowerLogReader,
+    logreaders.DstatLogReader and logreaders.ClientLogReader, onto a common
+    regular timeline.
+
+    Every grid point t stands for the interval (t - step, t]. A log added
+    without aggregation contributes its last sample at or before t, if that
+    sample is at most tolerance seconds old (as-of join). A log added with an
+    aggregation, e.g. 'median' for power samples or 'count' for requests,
+    contributes the aggregate of all its samples within the interval.
+    Both are resolved by binary search on the sorted log indices.
+
+    Parameters
+    ----------
+    step : float
+        Grid spacing in seconds
+    tolerance : float
+        Maximum age in seconds of a sample used for as-of joins
+    dtype : numpy.dtype
+        dtype of the aligned columns
+    '''
+    def __init__(self, step=1., tolerance=1., dtype=np.float32):
+        self._step = np.timedelta64(int(step * 1e9), 'ns')
+        self._tolerance = np.timedelta64(int(tolerance * 1e9), 'ns')
+        self._dtype = dtype
+        self._logs = list()
+
+    @property
+    def step(self):
+        return self._step
+
+    @property
+    def tolerance(self):
+        return self._tolerance
+
+    @property
+    def dtype(self):
+        return self._dtype
+
+    def add(self, log, columns=None, how=None):
+        '''Register a log to be aligned.
+
+        Parameters
+        ----------
+        log : pandas.DataFrame or pandas.Series with sorted DatetimeIndex
+        columns : list of strings, optional
+            Columns of log to take over, all by default
+        how : string, optional
+            Aggregation accepted by pandas groupby().agg(), e.g. 'mean',
+            'median', 'max' or 'count'. None means as-of join.
+        '''
+        if type(log) == pan.Series:
+            log = log.to_frame()
+        if columns is None:
+            columns = list(log.columns)
+        self._logs.append((log, columns, how))
+
+    def grid(self, start, end):
+        '''Grid points from start to end, both inclusive.'''
+        start = np.datetime64(pan.Timestamp(start).value, 'ns')
+        end = np.datetime64(pan.Timestamp(end).value, 'ns')
+        n = int((end - start) // self.step) + 1
+        return start + np.arange(n) * self.step
+
+    def align(self, start=None, end=None):
+        '''Align all added logs between start and end. If omitted, the span
+        covered by all logs is used.
+
+        Returns
+        -------
+        pandas.DataFrame indexed by the grid, one column per added column
+        '''
+        assert len(self._logs) > 0
+        if start is None:
+            start = max(log.index[0] for log, _, _ in self._logs)
+        if end is None:
+            end = min(log.index[-1] for log, _, _ in self._logs)
+        grid = self.grid(start, end)
+        aligned = dict()
+        columns = list()
+        for log, colns, how in self._logs:
+            if how is None:
+                vals = self._asof(log, colns, grid)
+            else:
+                vals = self._aggregate(log, colns, how, grid)
+            for coln in colns:
+                assert coln not in aligned, 'duplicate column ' + str(coln)
+                aligned[coln] = vals[coln]
+                columns.append(coln)
+        return pan.DataFrame(aligned, index=pan.DatetimeIndex(grid),
+                columns=columns)
+
+    def align_testsets(self, testsetlog):
+        '''One aligned frame per testset of a datatypes.TestsetLog, cut from
+        the registered logs by binary search.'''
+        logs = self._logs
+        # samples up to one step or tolerance before a testset still count
+        margin = max(self.step, self.tolerance)
+        bounds = [(log.index.searchsorted(testsetlog.stimes - margin, 
+            side='left'), log.index.searchsorted(testsetlog.etimes, 
+                side='right')) for log, _, _ in logs]
+        frames = list()
+        try:
+            for i in range(len(testsetlog)):
+                self._logs = [(log.iloc[lo[i]:hi[i]], colns, how) for
+                        (log, colns, how), (lo, hi) in zip(logs, bounds)]
+                frames.append(self.align(testsetlog.stimes[i],
+                    testsetlog.etimes[i]))
+        finally:
+            self._logs = logs
+        return frames
+
+    def _asof(self, log, colns, grid):
+        times = log.index.values
+        pos = np.searchsorted(times, grid, side='right') - 1
+        valid = pos >= 0
+        pos[~valid] = 0
+        if len(times):
+            valid &= (grid - times[pos]) <= self.tolerance
+        else:
+            valid[:] = False
+        vals = dict()
+        for coln in colns:
+            col = np.empty(len(grid), dtype=self.dtype)
+            col.fill(np.nan)
+            if len(times):
+                col[valid] = log[coln].values[pos[valid]]
+            vals[coln] = col
+        return vals
+
+    def _aggregate(self, log, colns, how, grid):
+        times = log.index.values
+        # first grid point at or after each sample, i.e. its interval
+        codes = np.searchsorted(grid, times, side='left')
+        keep = (codes < len(grid)) & (times > grid[0] - self.step)
+        df = pan.DataFrame(dict((coln, log[coln].values[keep])
+            for coln in colns), columns=colns)
+        agg = df.groupby(codes[keep]).agg(how).reindex(np.arange(len(grid)))
+        if how in ('count', 'size', 'sum'):
+            agg = agg.fillna(0)
+        return dict((coln, agg[coln].values.astype(self.dtype))
+                for coln in colns)
+
+
+def align_power_dstat_client(pwr_log, dstat_log, client_log, testsetlog=None,
+        step=1., tolerance=1.):
+    '''Convenience wrapper for the usual combination: median power, as-of
+    dstat samples and the request count (as arate) and median transfer size
+    of the client log per step.
+
+    Returns
+    -------
+    list of pandas.DataFrame, one per testset, or a single pandas.DataFrame
+    if testsetlog is None
+    '''
+    aligner = LogAligner(step, tolerance)
+    aligner.add(pwr_log, [co.CN_PWR], how='median')
+    aligner.add(dstat_log)
+    reqs = pan.DataFrame({co.CN_ARAT: client_log[co.CN_TRSZ].values,
+        co.CN_TRSZ: client_log[co.CN_TRSZ].values}, index=client_log.index)
+    aligner.add(reqs, [co.CN_ARAT], how='count')
+    aligner.add(reqs, [co.CN_TRSZ], how='median')
+    if testsetlog is None:
+        frames = [aligner.align()]
+    else:
+        frames = aligner.align_testsets(testsetlog)
+    for frame in frames:
+        frame[co.CN_ARAT] /= step
+    return frames[0] if testsetlog is None else frames
@@ -91,6 +91,7 @@ RUK_DIRN = 'Performance'
 PWRK_DIRN  = 'Power'
 WLK_DIRN   = 'Workload'
 RES_DIRN  = 'Results'
+CACHE_DIRN = '.logcache'
 
 #FILE NAMES
 FN_RES_STAT = 'result_stats'
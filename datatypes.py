@@ -3,24 +3,104 @@ import numpy as np
 import pandas as pan
 
 import constants as co
+import stats_helper as shelp
 
 class TestsetLog():
-    '''Class intended to be used by logwriters.TestsetLogWriter.'''
+    '''Class intended to be used by logwriters.TestsetLogWriter.
+
+    Start and end times are kept as sorted datetime64 arrays which serve as
+    an interval index: slice() and locate() resolve all testsets by binary
+    search instead of masking the logs once per testset.
+
+    Parameters
+    ----------
+    testsets : list of Testset
+    '''
 
     def __init__(self, testsets):
         assert testsets is not None and len(testsets) > 0
         self._sets = testsets
+        self._init_arrays(
+                [t.stime for t in testsets],
+                [t.etime for t in testsets],
+                [t.msg for t in testsets])
+
+    @classmethod
+    def from_arrays(cls, stimes, etimes, msgs):
+        '''Build a TestsetLog without creating Testset objects upfront.'''
+        assert len(stimes) > 0 and len(stimes) == len(etimes) == len(msgs)
+        tlog = cls.__new__(cls)
+        tlog._sets = None
+        tlog._init_arrays(stimes, etimes, msgs)
+        return tlog
+
+    def _init_arrays(self, stimes, etimes, msgs):
+        stimes = np.asarray(pan.DatetimeIndex(stimes).values)
+        etimes = np.asarray(pan.DatetimeIndex(etimes).values)
+        msgs = np.asarray(msgs, dtype=object)
+        order = np.argsort(stimes, kind='mergesort')
+        if (order != np.arange(len(order))).any():
+            stimes, etimes, msgs = stimes[order], etimes[order], msgs[order]
+            if self._sets is not None:
+                self._sets = [self._sets[i] for i in order]
+        self._stimes = stimes
+        self._etimes = etimes
+        self._msgs = msgs
 
     @property
     def sets(self):
+        if self._sets is None:
+            self._sets = [Testset(pan.Timestamp(s), pan.Timestamp(e), m)
+                    for s, e, m in zip(self.stimes, self.etimes, self.msgs)]
         return self._sets
 
+    @property
+    def stimes(self):
+        return self._stimes
+
+    @property
+    def etimes(self):
+        return self._etimes
+
+    @property
+    def msgs(self):
+        return self._msgs
+
+    def __len__(self):
+        return len(self.stimes)
+
     def firstset(self):
         return self.sets[0]
 
     def lastset(self):
         return self.sets[len(self.sets) - 1]
 
+    def locate(self, times):
+        '''Position of the testset each of times falls into, -1 if none.
+        Assumes testsets do not overlap.'''
+        times = np.asarray(pan.DatetimeIndex(times).values)
+        pos = np.searchsorted(self.stimes, times, side='right') - 1
+        inside = (pos >= 0) & (times <= self.etimes[np.maximum(pos, 0)])
+        return np.where(inside, pos, -1)
+
+    def bounds(self, index):
+        '''Integer bounds [lo, hi) of every testset in a sorted
+        pandas.DatetimeIndex.'''
+        lo = index.searchsorted(self.stimes, side='left')
+        hi = index.searchsorted(self.etimes, side='right')
+        return lo, hi
+
+    def slice(self, log):
+        '''Cut a time-indexed pandas.DataFrame or pandas.Series into one
+        piece per testset. Pieces are positional slices, i.e. views, of
+        log. The index of log must be sorted.
+
+        Returns
+        -------
+        list of pieces in the order of self.sets
+        '''
+        lo, hi = self.bounds(log.index)
+        return [log.iloc[l:h] for l, h in zip(lo, hi)]
 
 class Testset():
 
@@ -62,34 +142,128 @@ class MeasurementData(object):
         Formula used to produce fitted_cdf
     source : string
         Denotes the application or service that produced the original series
+    sketch : stats_helper.QuantileSketch, optional
+        Summarizes the measurements in constant memory. If series is None,
+        STD, CDF and describe() are served from the sketch.
     '''
     def __init__(self, series, cdf=None, fitted_cdf=None, formula = None,
-            source='', test=''):
+            source='', test='', sketch=None):
+        assert series is not None or sketch is not None
         self._series = series
+        self._sketch = sketch
         self._cdf = cdf
         self._fitted_cdf = fitted_cdf
         self._formula = formula
         self._source = source
         self._test = test
-        self._STD = np.round(self.series.std(), decimals = 5)
+        self._counts = None
+        self._moments = None
+        self._length = None
+        self._pending = list()
+        self._pending_counts = list()
+        self._cdf_stale = False
+        if series is None:
+            self._STD = np.round(sketch.std, decimals = 5)
+        else:
+            self._STD = np.round(self.series.std(), decimals = 5)
         #if self.STD < 1e-6:
             #self.STD = 0.
 
+    @classmethod
+    def from_sketch(cls, sketch, source='', test=''):
+        '''Sketch-backed MeasurementData without the original series'''
+        return cls(None, source=source, test=test, sketch=sketch)
+
+    def extend(self, series):
+        '''Append new measurements, e.g. from logreaders.DstatLogReader.poll().
+
+        STD is updated from running moments and, if a CDF has been set, the
+        value counts of the new measurements are queued. Thus, only the new
+        measurements are scanned, the CDF is rebuilt from running value counts
+        when it is read next. A sketch is updated as well.'''
+        if self.sketch is not None:
+            self.sketch.add(series)
+        if self._cdf is not None:
+            self._cdf_stale = True
+        if self._series is None:
+            self._STD = np.round(self.sketch.std, decimals = 5)
+            return
+        if self._moments is None:
+            self._moments = shelp.moments(self.series)
+            self._length = len(self.series)
+        self._moments = shelp.merge_moments(self._moments, 
+                shelp.moments(series))
+        n, mean, m2 = self._moments
+        std = np.sqrt(m2 / (n - 1)) if n > 1 else np.nan
+        self._STD = np.round(std, decimals = 5)
+        # appended lazily by the series property, thus extending is not
+        # slowed down by the measurements collected so far
+        self._pending.append(series)
+        self._length += len(series)
+        if self._counts is not None:
+            self._pending_counts.append(series.value_counts())
+
     @property
     def series(self):
+        if self._pending:
+            self._series = pan.concat([self._series] + self._pending)
+            self._pending = list()
         return self._series
 
+    @property
+    def sketch(self):
+        return self._sketch
+
+    @property
+    def name(self):
+        if self._series is None:
+            return self.sketch.name
+        return self._series.name
+
+    def get_cdf(self):
+        '''Empirical CDF of the series, or the approximate one of the sketch
+        if there is no series.'''
+        if self.series is None:
+            return self.sketch.to_ecdf().to_series()
+        return shelp.get_cdf(self.series)
+
+    def describe(self, percentiles=[.25, .5, .75]):
+        if self.series is None:
+            return self.sketch.describe(percentiles)
+        return self.series.describe(percentiles=percentiles)
+
     @series.setter
     def series(self, series):
         self._series = series
+        self._pending = list()
+        self._moments = None
+        self._counts = None
+        self._pending_counts = list()
 
     @property
     def cdf(self):
+        if self._cdf_stale:
+            self._cdf = self._running_cdf()
+            self._cdf_stale = False
         return self._cdf
 
     @cdf.setter
     def cdf(self, cdf):
         self._cdf = cdf
+        self._cdf_stale = False
+
+    def _running_cdf(self):
+        if self._series is None:
+            return self.sketch.to_ecdf().to_series()
+        if self._counts is None:
+            self._counts = self.series.value_counts()
+            self._length = len(self.series)
+        elif self._pending_counts:
+            self._counts = pan.concat([self._counts] +
+                    self._pending_counts).groupby(level=0).sum()
+        self._pending_counts = list()
+        return shelp.get_cdf_from_counts(self._counts, self._length,
+                self.name)
 
     @property
     def fitted_cdf(self):
@@ -145,6 +319,15 @@ class MeasurementDataContainer(object):
         assert type(md) == MeasurementData
         self._mds[name] = md
 
+    def extend(self, log):
+        '''Extend every MeasurementData by the new rows of the reader log it
+        was taken from, e.g. as returned by logreaders.DstatLogReader.poll()
+        or logreaders.PowerLogReader.poll().'''
+        if log is None or len(log) == 0:
+            return
+        for name, md in self.mds.items():
+            md.extend(log[name])
+
     @property
     def source(self):
         return self._source
@@ -168,12 +351,14 @@ class CPUMeasurementDataContainer(MeasurementDataContainer):
     dlogreader : logreaders.DstatLogReader
         Contains log data from dstat as pandas.DataFrame
     '''
+    #log columns needed, see logreaders.DstatLogReader(columns=...)
+    columns = [co.CN_USR, co.CN_SYS, co.CN_CPU]
+
     def __init__(self, dlogreader):
         super(CPUMeasurementDataContainer, self).__init__(
                 dlogreader.source,
                 dlogreader.test)
-        names = [co.CN_USR, co.CN_SYS, co.CN_CPU]
-        for name in names:
+        for name in self.columns:
             self.mds[name] = MeasurementData(
                     dlogreader.log[name], 
                     source = dlogreader.source,
@@ -181,13 +366,14 @@ class CPUMeasurementDataContainer(MeasurementDataContainer):
 
 
 class DiskMeasurementDataContainer(MeasurementDataContainer):
+    #names = ['read', 'writ', 'disk', 'dutl']
+    columns = [co.CN_DISKLOG10, co.CN_DUTIL]
+
     def __init__(self, dlogreader):
         super(DiskMeasurementDataContainer, self).__init__(
                 dlogreader.source,
                 dlogreader.test)
-        #names = ['read', 'writ', 'disk', 'dutl']
-        names = [co.CN_DISKLOG10, co.CN_DUTIL]
-        for name in names:
+        for name in self.columns:
             self.mds[name] = MeasurementData(
                     dlogreader.log[name],
                     source = dlogreader.source,
@@ -195,13 +381,14 @@ class DiskMeasurementDataContainer(MeasurementDataContainer):
 
 
 class NetMeasurementDataContainer(MeasurementDataContainer):
+    #names = ['send', 'recv', 'net', 'nutl']
+    columns = [co.CN_NETLOG10, co.CN_NUTIL]
+
     def __init__(self, dlogreader):
         super(NetMeasurementDataContainer, self).__init__(
                 dlogreader.source,
                 dlogreader.test)
-        #names = ['send', 'recv', 'net', 'nutl']
-        names = [co.CN_NETLOG10, co.CN_NUTIL]
-        for name in names:
+        for name in self.columns:
             self.mds[name] = MeasurementData(
                     dlogreader.log[name],
                     source = dlogreader.source,
@@ -209,21 +396,32 @@ class NetMeasurementDataContainer(MeasurementDataContainer):
 
 
 class LoadAverageMeasurementDataContainer(MeasurementDataContainer):
+    columns = [co.CN_1M, co.CN_5M, co.CN_15M]
+    alt_names = [co.CN_X1M, co.CN_X5M, co.CN_X15M]
+
     def __init__(self, dlogreader):
         super(LoadAverageMeasurementDataContainer,
                 self).__init__(dlogreader.source, dlogreader.test)
-        names = [co.CN_1M, co.CN_5M, co.CN_15M]
-        alt_names = [co.CN_X1M, co.CN_X5M, co.CN_X15M]
-        df = pan.DataFrame(dlogreader.log, columns=names)
-        df.columns = alt_names
+        df = pan.DataFrame(dlogreader.log, columns=self.columns)
+        df.columns = self.alt_names
         for name in df.columns:
             self.mds[name] = MeasurementData(
                     df[name], 
                     source = dlogreader.source,
                     test = dlogreader.test)
 
+    def extend(self, log):
+        if log is None or len(log) == 0:
+            return
+        df = pan.DataFrame(log, columns=self.columns)
+        df.columns = self.alt_names
+        super(LoadAverageMeasurementDataContainer, self).extend(df)
+
 
 class PowerMeasurementDataContainer(MeasurementDataContainer):
+    #log columns needed, see logreaders.PowerLogReader(columns=...)
+    columns = [co.CN_PWR]
+
     def __init__(self, pwrlogreader):
         super(PowerMeasurementDataContainer, self).__init__(
                 pwrlogreader.source,
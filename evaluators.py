@@ -16,16 +16,53 @@ import stats_helper as shelp
 import constants as co
 import plotting
 import printing
+import regression
 import logwriters as writing
 from datatypes import MeasurementData
 
 
+def fitted_cdf(res, resp_ser, pred):
+    '''CDF of the response as estimated by the regression result res'''
+    if resp_ser.name in printing.logxs:
+    #if LHS was logarithmically transformed for the fitting we need to
+    #compute the fitted CDF manually. Just taking res.fittedvalues
+    #leads to high deviation between the original CDF and the fit.
+        if type(pred) == pan.Series:
+            coef = res.params[printing.cond_wrap_term_log10(pred.name) ] 
+            fit_cdf = shelp.get_inv_cdf(shelp.get_cdf(pred)) * coef +\
+                res.params['Intercept']
+            return shelp.get_inv_cdf(fit_cdf)
+        else:
+            raise NotImplementedError, 'manually computing fitted CDF if \
+            predictor is a pandas.DataFrame is not implemented.'
+    # for some brilliant reason the fitted values are sometimes out of 
+    # order in the upper quantiles if multiple regression is applied
+    # thus, we need to sort it
+    res.fittedvalues.values.sort()
+    return shelp.get_inv_cdf(res.fittedvalues)
+
+
 class EDFRegressionEvaluator(object):
-    def __init__(self, steps=30):
-        start = 0.001
-        self._steps = steps
-        self._q_ords = np.linspace(0, 1, self.steps)
-        self._q_ords[0] = start
+    # shared by all instances, i.e. by all models of a sweep. Bounded in
+    # size, call quantile_cache.clear() to release it early.
+    quantile_cache = shelp.QuantileCache()
+
+    def __init__(self, steps=30, q_ords=None):
+        '''
+        Parameters
+        ----------
+        steps : int
+            Number of points of the uniform probability grid
+        q_ords : array-like, optional
+            Custom, e.g. non-uniform, probability grid, see
+            stats_helper.quantile_grid(). Overrides steps.
+        '''
+        if q_ords is None:
+            q_ords = shelp.quantile_grid(steps)
+        self._q_ords = np.asarray(q_ords, dtype=np.float64)
+        assert np.all(np.diff(self._q_ords) > 0), \
+                'probability grid not increasing'
+        self._steps = len(self._q_ords)
 
     @property
     def q_ords(self):
@@ -60,38 +97,59 @@ class EDFRegressionEvaluator(object):
         result : statsmodels.regression.linear_model.RegressionResults OR None
         
         '''
-        pred_est_qfs = list()
-        resp_est_inv_cdfs = list()
-        for coln in predictors_df.columns:
-            pred_ser = predictors_df[coln]
-            pred_ser.dropna(inplace=True)
-
-            #we change the role of response and predictor for the purpose of 
-            #quantile estimation. The reason is that we take the quantiles of the
-            #respone variable as single reference to estimate the quantiles of 
-            #all components in the predictor
-            pred_est_qf = shelp.estimate_quantiles(pred_ser, self.q_ords)
-
-            pred_est_qfs.append(pred_est_qf)
-        
-        pred_est_qfs_df = pan.concat(pred_est_qfs, axis=1)
-        resp_qf = shelp.estimate_quantiles(resp_ser, self.q_ords)
+        #we change the role of response and predictor for the purpose of 
+        #quantile estimation. The reason is that we take the quantiles of the
+        #respone variable as single reference to estimate the quantiles of 
+        #all components in the predictor
+        pred_est_qfs_df = self.quantile_cache.quantiles_df(predictors_df, 
+                self.q_ords)
+        resp_qf = self.quantile_cache.quantiles(resp_ser, self.q_ords)
         resp_qf_df = pan.DataFrame(resp_qf )
         combi_df = pan.concat([pred_est_qfs_df, resp_qf_df], axis=1)
 
         if reg == co.REGR_OLS:
-            model = smfapi.ols(formula = formula, data=combi_df)
-            res = model.fit(
-                    cov_type='HAC', 
-                    cov_kwds={'maxlags':lag, 'use_correction': False}
-                    )
+            try:
+                res = regression.ols(formula, combi_df, lag)
+            except NotImplementedError:
+                model = smfapi.ols(formula = formula, data=combi_df)
+                res = model.fit(
+                        cov_type='HAC', 
+                        cov_kwds={'maxlags':lag, 'use_correction': False}
+                        )
         elif reg == co.REGR_GLSAR:
-            model = smfapi.glsar(formula=formula, data=combi_df, rho=lag)
-            res = model.iterative_fit(maxiter=6)
+            try:
+                res = regression.glsar(formula, combi_df, lag, maxiter=6)
+            except NotImplementedError:
+                model = smfapi.glsar(formula=formula, data=combi_df, rho=lag)
+                res = model.iterative_fit(maxiter=6)
         else: res = None
         return res
 
 
+    def fit_models(self, rhs, resp_sers, predictors_df, lag=0, 
+            reg=co.REGR_OLS):
+        '''fit_model() for several responses sharing the right hand side
+        rhs of the formula. GLSAR fits are solved as one batch.
+
+        Returns
+        -------
+        list of (result, formula)
+        '''
+        formulas = [ser.name + ' ~ ' + rhs for ser in resp_sers]
+        names = set(ser.name for ser in resp_sers)
+        if reg == co.REGR_GLSAR and len(names) == len(resp_sers) and \
+                not names & set(predictors_df.columns):
+            combi_df = pan.concat([self.quantile_cache.quantiles_df(
+                predictors_df, self.q_ords)] + [self.quantile_cache.quantiles(
+                    ser, self.q_ords) for ser in resp_sers], axis=1)
+            try:
+                return zip(regression.glsar_many(formulas, combi_df, lag,
+                    maxiter=6), formulas)
+            except NotImplementedError:
+                pass
+        return [(self.fit_model(formula, ser, predictors_df, lag, reg),
+            formula) for formula, ser in zip(formulas, resp_sers)]
+
 class SimpleModel(object):
     def __init__(self, resp_ser, pred_ser, tpath, formula=None, test='', lag=0,
             reg=co.REGR_OLS, steps=30):
@@ -169,7 +227,7 @@ class MultipleModel(object):
 class MeasurementDataEvaluator(object):
     def __init__(self, md, tpath):
         self._md = md
-        self.md.cdf = shelp.get_cdf(self.md.series)
+        self.md.cdf = self.md.get_cdf()
         self._tpath = tpath
 
     @property
@@ -190,14 +248,18 @@ class MeasurementDataEvaluator(object):
 
     def summarize(self):
         try:
-            plotting.plot_cdf(self.md.cdf, self.md.series.name, self.tpath)
+            plotting.plot_cdf(self.md.cdf, self.md.name, self.tpath)
         except TypeError:
-            print 'WARNING: summarize', self.md.series.name, 'skipped. Appears \
+            print 'WARNING: summarize', self.md.name, 'skipped. Appears \
                     empty.'
-        writing.write_stats(self.md.series.describe(percentiles=[.05, .5, .95]), 
-                self.md.series.name, self.tpath)
+        writing.write_stats(self.md.describe(percentiles=[.05, .5, .95]), 
+                self.md.name, self.tpath)
 
     def model(self, pred, formula=None, lag=0, reg=co.REGR_OLS, steps=30):
+        if self.md.series is None:
+            print 'WARNING: modeling', self.md.name, 'skipped. Only a \
+                    sketch is available.'
+            return None
         if np.isnan(self.md.STD):
             print 'WARNING: modeling', self.md.series.name, 'skipped. Appears \
                     empty.'
@@ -243,25 +305,7 @@ class MeasurementDataEvaluator(object):
         #res_writer.pickle()
         res_writer.write_regr_summ()
 
-        if self.md.series.name in printing.logxs:
-        #if LHS was logarithmically transformed for the fitting we need to
-        #compute the fitted CDF manually. Just taking res.fittedvalues
-        #leads to high deviation between the original CDF and the fit.
-            if type(pred) == pan.Series:
-                coef = res.params[printing.cond_wrap_term_log10(pred.name) ] 
-                fit_cdf = shelp.get_inv_cdf(shelp.get_cdf(pred)) * coef +\
-                    res.params['Intercept']
-                fit_cdf = shelp.get_inv_cdf(fit_cdf)
-            else:
-                raise NotImplementedError, 'manually computing fitted CDF if \
-                predictor is a pandas.DataFrame is not implemented.'
-        else:
-            # for some brilliant reason the fitted values are sometimes out of 
-            # order in the upper quantiles if multiple regression is applied
-            # thus, we need to sort it
-            res.fittedvalues.values.sort()
-            fit_cdf = shelp.get_inv_cdf(res.fittedvalues)
-
+        fit_cdf = fitted_cdf(res, self.md.series, pred)
         fit_cdf.name = self.md.series.name + ' (estimated)'
         self.md.fitted_cdf = fit_cdf
         self.md.formula = formula
@@ -285,7 +329,8 @@ class MeasurementDataEvaluator(object):
                     [self.md.series.name, pred.name],
                     fpath)
 
-        fitted_rvs = shelp.rvs_from_cdf(self.md.fitted_cdf)
+        fitted_rvs = shelp.rvs_from_cdf(self.md.fitted_cdf,
+                size=len(self.md.series))
 
         res_writer.write_stats(fitted_rvs.describe(percentiles=[.05, .5, .95]))
 
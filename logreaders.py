@@ -1,8 +1,17 @@
 # -*- coding: utf-8 -*-
 
+import cPickle as pickle
 import dateutil.parser as dup
-import operator as op
+import functools
+import glob
+import hashlib
+import io
+import multiprocessing as mp
+import os
 import os.path as osp
+import re
+import shutil
+import tempfile
 import datetime as dt
 import pandas as pan
 import numpy as np
@@ -13,13 +22,160 @@ import parsers
 import constants as co
 import printing
 
+
+# version of the layout written by store_cached_df()
+CACHE_FORMAT = 1
+
+def cached(read):
+    '''Decorator for LogReader.read() implementations that produce a
+    pandas.DataFrame in self.log.
+
+    If the reader has a cache_dir set, the derived DataFrame is stored after
+    the first read, one .npy file per column, and memory-mapped back in on
+    later calls instead of parsing the text log again. See
+    LogReader.cache_path() for how entries are keyed. Afterwards, tail() and
+    thus poll() continue after the lines read.'''
+    @functools.wraps(read)
+    def wrapper(self):
+        if self.cache_dir is None or getattr(self, '_in_cached_read', False):
+            read(self)
+            self.seek_tail()
+            return
+        cpath = self.cache_path()
+        if osp.isdir(cpath):
+            try:
+                self.log = load_cached_df(cpath)
+                self.seek_tail()
+                return
+            except (IOError, OSError, EOFError, pickle.UnpicklingError):
+                pass # stale or incomplete entry, re-read and overwrite it
+        self._in_cached_read = True
+        try:
+            read(self)
+        finally:
+            self._in_cached_read = False
+        store_cached_df(self.log, cpath)
+        self.seek_tail()
+    return wrapper
+
+def store_cached_df(df, cpath):
+    '''Store df column-wise as .npy files in the directory cpath.
+
+    The entry is written to a temporary directory first and then renamed, so
+    concurrent readers never see a partial entry. Caching is best-effort: if
+    the entry cannot be written, e.g. the cache directory is not writable or
+    the disk is full, a warning is printed and nothing is stored.'''
+    parent = osp.dirname(cpath)
+    tmp = None
+    try:
+        if not osp.isdir(parent):
+            try:
+                os.makedirs(parent)
+            except OSError:
+                pass # created concurrently, else mkdtemp() fails below
+        tmp = tempfile.mkdtemp(dir=parent)
+        _write_cached_df(df, tmp)
+        if osp.isdir(cpath):
+            shutil.rmtree(cpath, ignore_errors=True)
+        os.rename(tmp, cpath)
+    except (IOError, OSError), err:
+        if tmp is not None:
+            shutil.rmtree(tmp, ignore_errors=True)
+        if not osp.isdir(cpath): # else another process won the race
+            print 'WARNING: caching', cpath, 'failed.', err
+
+def _write_cached_df(df, tmp):
+    meta = {'columns': list(df.columns), 'index': df.index.name,
+            'tz': getattr(df.index, 'tz', None)}
+    idx = df.index.values
+    meta['index_dtype'] = idx.dtype.str
+    if idx.dtype.kind == 'M':
+        idx = idx.view(np.int64)
+    np.save(osp.join(tmp, 'index.npy'), _to_storable(idx))
+    meta['dtypes'] = list()
+    meta['categories'] = dict()
+    for i, coln in enumerate(df.columns):
+        ser = df.iloc[:, i]
+        if str(ser.dtype) == 'category':
+            # store the codes, the categories are small and go to meta
+            meta['dtypes'].append('category')
+            meta['categories'][i] = list(ser.cat.categories)
+            vals = ser.cat.codes.values
+        else:
+            vals = ser.values
+            meta['dtypes'].append(vals.dtype.str)
+        np.save(osp.join(tmp, '%d.npy' % i), _to_storable(vals))
+    with open(osp.join(tmp, 'meta.pkl'), 'wb') as metaf:
+        pickle.dump(meta, metaf, pickle.HIGHEST_PROTOCOL)
+
+def load_cached_df(cpath):
+    '''Inverse of store_cached_df(). Columns are memory-mapped.'''
+    with open(osp.join(cpath, 'meta.pkl'), 'rb') as metaf:
+        meta = pickle.load(metaf)
+    idx = np.load(osp.join(cpath, 'index.npy'), mmap_mode='r')
+    idx_dtype = np.dtype(meta['index_dtype'])
+    if idx_dtype.kind == 'M':
+        index = pan.DatetimeIndex(idx.view(idx_dtype), name=meta['index'],
+                tz=meta['tz'])
+    else:
+        index = pan.Index(idx.astype(idx_dtype), name=meta['index'])
+    arrays = list()
+    for i, dtype in enumerate(meta['dtypes']):
+        vals = np.load(osp.join(cpath, '%d.npy' % i), mmap_mode='r')
+        if dtype == 'category':
+            vals = pan.Categorical.from_codes(vals, meta['categories'][i])
+        elif np.dtype(dtype) == np.object_:
+            vals = vals.astype(np.object_)
+        arrays.append(vals)
+    return _frame_from_columns(arrays, index, meta['columns'])
+
+def _frame_from_columns(arrays, index, columns):
+    '''DataFrame with one block per column. The DataFrame constructor of
+    pandas < 2 consolidates columns of the same dtype into new arrays, which
+    would read and copy memory-mapped columns completely.'''
+    if int(pan.__version__.split('.')[0]) >= 2:
+        return pan.DataFrame(dict(zip(columns, arrays)), index=index, 
+                columns=columns, copy=False)
+    from pandas.core.internals import BlockManager, make_block
+    blocks = list()
+    for i, vals in enumerate(arrays):
+        if isinstance(vals, np.ndarray):
+            vals = vals.reshape(1, -1)
+        blocks.append(make_block(vals, placement=[i]))
+    return pan.DataFrame(BlockManager(blocks, [pan.Index(columns), index]))
+
+def _to_storable(vals):
+    '''Object columns (e.g. file names) cannot be memory-mapped. Store them as
+    fixed-width strings instead.'''
+    if vals.dtype == np.object_:
+        return vals.astype(str)
+    return vals
+
+
 class LogReader(object):
+    '''Base class of all log readers.
+
+    Setting cache_dir, either on the class to affect all readers or on a
+    single instance, enables the on-disk cache of parsed logs (see cached()).
+    None disables caching, '' stores the cache next to the source file in a
+    co.CACHE_DIRN directory.'''
+
+    cache_dir = None
+    # bump whenever read() of a class produces different columns or dtypes,
+    # so older cache entries are not served anymore
+    cache_version = 1
+    # lines preceding the data, see tail()
+    header_lines = 1
+
     def __init__(self, fpath, source='', test=''):
         self._timef = formatdefs.default_timef
         self._fpath = fpath
         self._source = source
         self._log = None
         self._test = test
+        self._tail_offset = None
+        self._tail_header = None
+        self._polled = list()
 
     @property
     def fpath(self):
@@ -30,7 +186,7 @@ class LogReader(object):
         return self._source
 
     @source.setter
-    def source(source):
+    def source(self, source):
         self._source = source
 
     @property
@@ -47,11 +203,92 @@ class LogReader(object):
 
     @property
     def log(self):
+        if self._polled:
+            self._log = pan.concat(([] if self._log is None else [self._log])
+                    + self._polled)
+            self._polled = list()
         return self._log
 
     @log.setter
     def log(self, log):
         self._log = log
+        self._polled = list()
+
+    def append_polled(self, chunk):
+        '''Append chunk to log. The chunks are concatenated once log is
+        accessed, thus polling costs are independent of the log size.'''
+        if len(chunk):
+            self._polled.append(chunk)
+
+    def cache_params(self):
+        '''Reader parameters that influence the parsed log. Subclasses
+        extend this so that the cache entry changes with them.'''
+        return dict()
+
+    def cache_path(self):
+        '''Path of the cache entry for the current source file and
+        parameters. Keyed by the absolute source path, its size and mtime,
+        the reader class, its cache_version, cache_params() and the storage
+        format CACHE_FORMAT.'''
+        fpath = osp.abspath(self.fpath)
+        fstat = os.stat(fpath)
+        key = repr((CACHE_FORMAT, fpath, fstat.st_size, fstat.st_mtime,
+            type(self).__name__, self.cache_version,
+            sorted(self.cache_params().items())))
+        digest = hashlib.sha1(key).hexdigest()[:16]
+        cdir = self.cache_dir
+        if cdir == '':
+            cdir = osp.join(osp.dirname(fpath), co.CACHE_DIRN)
+        return osp.join(cdir, '.'.join([osp.basename(fpath), digest]))
+
+    def tail(self, header_lines=None):
+        '''Return the complete lines appended to the log file since the last
+        call, prefixed by the header_lines (default: self.header_lines)
+        header lines, or None if there are none. A trailing line still being
+        written is left for the next call. The first call returns everything
+        written so far, unless seek_tail() or read() came first.'''
+        if header_lines is None:
+            header_lines = self.header_lines
+        with open(self.fpath, 'rb') as logf:
+            if self._tail_header is None:
+                header = ''.join(logf.readline() for i in range(header_lines))
+                if header.count('\n') < header_lines:
+                    return None
+                self._tail_header = header
+                self._tail_offset = logf.tell()
+            logf.seek(self._tail_offset)
+            data = logf.read()
+        end = data.rfind('\n') + 1
+        if end == 0:
+            return None
+        self._tail_offset += end
+        return self._tail_header + data[:end]
+
+    def seek_tail(self, header_lines=None):
+        '''Let tail() continue after the last complete line of the log file,
+        i.e. skip everything read so far. Only the end of the file is
+        scanned.'''
+        if header_lines is None:
+            header_lines = self.header_lines
+        with open(self.fpath, 'rb') as logf:
+            header = ''.join(logf.readline() for i in range(header_lines))
+            if header.count('\n') < header_lines:
+                return # no data yet, tail() starts at the beginning
+            start = logf.tell()
+            logf.seek(0, os.SEEK_END)
+            pos = offset = logf.tell()
+            while pos > start:
+                size = min(64 * 1024, pos - start)
+                logf.seek(pos - size)
+                nl_idx = logf.read(size).rfind('\n')
+                if nl_idx > -1:
+                    offset = pos - size + nl_idx + 1
+                    break
+                pos -= size
+            else:
+                offset = start
+        self._tail_header = header
+        self._tail_offset = offset
 
     def read(self):
         '''
@@ -64,87 +301,248 @@ class LogReader(object):
         self.log = pan.read_csv(self.fpath)
 
 class DstatLogReader(LogReader):
-    def __init__(self, fpath='', source='', year='', test=''):
+    '''Reads dstat CSV logs and derives cpu, disk and net columns.
+
+    Parameters
+    ----------
+    columns : list of strings, optional
+        Raw or derived columns the caller needs, e.g.
+        datatypes.CPUMeasurementDataContainer.columns. If given, only these
+        and the raw columns they are derived from are parsed, as float32.
+        By default, all columns are kept as float64.
+    '''
+
+    #raw columns each derived column is computed from
+    derived_from = {
+            co.CN_CPU      : [co.CN_IDL],
+            co.CN_DISK     : [co.CN_READ, co.CN_WRIT],
+            co.CN_DISKLOG10: [co.CN_READ, co.CN_WRIT],
+            co.CN_DUTIL    : [co.CN_READ, co.CN_WRIT],
+            co.CN_NET      : [co.CN_RECV, co.CN_SEND],
+            co.CN_NETLOG10 : [co.CN_RECV, co.CN_SEND],
+            co.CN_NUTIL    : [co.CN_RECV, co.CN_SEND],
+            co.CN_X1M      : [co.CN_1M],
+            co.CN_X5M      : [co.CN_5M],
+            co.CN_X15M     : [co.CN_15M],
+            }
+    header_lines = 2 # group and column header
+    default_chunksize = 100000 # rows, see iter_chunks()
+
+    def __init__(self, fpath='', source='', year='', test='', columns=None):
         super(DstatLogReader, self).__init__(fpath, source, test)
         self.timef = formatdefs.dstat_timef
         self.time_parser = parsers.DstatTimeParser(year)
         self.year = year
         self.diskmax = 485490688.0 #B/s
         self.netmax = 1252942130.0 #B/s
-
+        self.chunksize = None # rows; if set, read() streams the log
+        self.columns = columns
+
+    def cache_params(self):
+        params = super(DstatLogReader, self).cache_params()
+        params.update(year=self.time_parser.year, diskmax=self.diskmax,
+                netmax=self.netmax)
+        if self.columns is not None:
+            params.update(columns=sorted(self.columns))
+        return params
+
+    def raw_columns(self):
+        '''Raw dstat columns to parse for self.columns.'''
+        raw = list()
+        for coln in self.columns:
+            for rawn in self.derived_from.get(coln, [coln]):
+                if rawn not in raw:
+                    raw.append(rawn)
+        return raw
+
+    def wants(self, coln):
+        return self.columns is None or coln in self.columns
+
+    @cached
     def read(self):
         assert self.fpath != ''
-        raw_df = pan.read_csv(
-                self.fpath, 
+        if self.chunksize:
+            self.log = self._read_chunked()
+        else:
+            self.log = self._derive(self._parse_index(self._read_csv()))
+
+    def iter_chunks(self, chunksize=None):
+        '''Yield the log as a sequence of DataFrames of at most chunksize
+        rows (default: self.chunksize or, if unset, default_chunksize), each
+        with the same derived columns as read() produces. Nothing is kept
+        between chunks, thus memory stays bounded by the chunk size.'''
+        assert self.fpath != ''
+        chunksize = chunksize or self.chunksize or self.default_chunksize
+        prev = None
+        for chunk in self._read_csv(chunksize=chunksize):
+            chunk = self._derive(self._parse_index(chunk, prev))
+            if len(chunk):
+                prev = chunk.index[-1]
+            yield chunk
+
+    def poll(self):
+        '''Follow mode for growing logs: parse only the lines appended since
+        the last poll(), derive their columns and append them to self.log.
+        The first call reads everything written so far, or everything
+        written since read().
+
+        Returns
+        -------
+        pandas.DataFrame with the new rows only, or None
+        '''
+        assert self.fpath != ''
+        text = self.tail()
+        if text is None:
+            return None
+        prev = None
+        last = self._polled[-1] if self._polled else self._log
+        if last is not None and len(last):
+            prev = last.index[-1]
+        chunk = self._derive(self._parse_index(
+            self._read_csv(io.BytesIO(text)), prev))
+        self.append_polled(chunk)
+        return chunk
+
+    def _read_csv(self, src=None, **kwargs):
+        if self.columns is not None:
+            raw = self.raw_columns()
+            kwargs.update(usecols=['time'] + raw,
+                    dtype=dict((coln, np.float32) for coln in raw))
+        return pan.read_csv(
+                self.fpath if src is None else src, 
                 skiprows=1, 
-                parse_dates=0, 
-                date_parser=self.time_parser.parse, 
-                index_col='time')
-        cpu_ser = 100.0 - raw_df[co.CN_IDL]
-        cpu_ser.name = co.CN_CPU
-        
-        disk_ser = raw_df[co.CN_READ] + raw_df[co.CN_WRIT]
-        disk_ser.name = co.CN_DISK
-#workaround since unpickling RegressionResult with tranformed variables (e.g.
-#np.log10(var) fails as of 2015-04 (statsmodels < 0.7)
-#FIXME check with statsmodels 0.7
-        disk_ser_cpy = disk_ser
-#necessary sincw otherwise OLS.fit() will run forever
-        disk_ser_cpy[disk_ser_cpy < 1.] = 1.
-        disk_log10_ser = pan.Series(np.log10(disk_ser_cpy))
-        disk_log10_ser.name = co.CN_DISKLOG10
-        del disk_ser_cpy
-        
-        dutil_ser = 100 * disk_ser / self.diskmax
-        dutil_ser.name = co.CN_DUTIL
-
-        net_ser = raw_df[co.CN_RECV] + raw_df[co.CN_SEND]
-        net_ser.name = co.CN_NET
+                index_col='time',
+                **kwargs)
+
+    def _parse_index(self, raw_df, prev=None):
+        raw_df.index = pan.DatetimeIndex(
+                self.time_parser.parse_array(raw_df.index.values, prev),
+                name=raw_df.index.name)
+        return raw_df
+
+    def _derive(self, raw_df):
+        '''Add the derived columns to raw_df in place. If self.columns is
+        set, only the requested ones are added and raw columns that were only
+        needed for the derivation are dropped.'''
+        if self.wants(co.CN_CPU):
+            raw_df[co.CN_CPU] = 100.0 - raw_df[co.CN_IDL]
 #workaround since unpickling RegressionResult with tranformed variables (e.g.
 #np.log10(var) fails as of 2015-04 (statsmodels < 0.7)
 #FIXME check with statsmodels 0.7
-        net_ser_cpy = net_ser
-#necessary sincw otherwise OLS.fit() will run forever
-        net_ser_cpy[net_ser_cpy < 1.] = 1.
-        net_log10_ser = pan.Series(np.log10(net_ser_cpy))
-        net_log10_ser.name = co.CN_NETLOG10
-        del net_ser_cpy
-        
-        nutil_ser = 100 * net_ser / self.netmax
-        nutil_ser.name = co.CN_NUTIL
-        
-        extra_df = pan.concat(
-                [cpu_ser, 
-                    disk_ser, 
-                    net_ser, 
-                    disk_log10_ser, 
-                    net_log10_ser, 
-                    dutil_ser, 
-                    nutil_ser,
-                    raw_df['1m'],
-                    raw_df['5m'],
-                    raw_df['15m'],
-                    ],
-                axis=1)
-        renames = {'1m': co.CN_X1M, '5m': co.CN_X5M, '15m': co.CN_X15M}
-        extra_df.rename(columns=renames, inplace = True)
-        self.log = raw_df.join(extra_df)
+#clipping at 1 is necessary since otherwise OLS.fit() will run forever
+        dtype = np.float64 if self.columns is None else np.float32
+        disk = net = None
+        if (self.wants(co.CN_DISK) or self.wants(co.CN_DISKLOG10) or
+                self.wants(co.CN_DUTIL)):
+            disk = np.add(raw_df[co.CN_READ].values, 
+                    raw_df[co.CN_WRIT].values, dtype=dtype)
+            np.maximum(disk, 1., out=disk)
+        if (self.wants(co.CN_NET) or self.wants(co.CN_NETLOG10) or
+                self.wants(co.CN_NUTIL)):
+            net = np.add(raw_df[co.CN_RECV].values, 
+                    raw_df[co.CN_SEND].values, dtype=dtype)
+            np.maximum(net, 1., out=net)
+        for coln, vals in [
+                (co.CN_DISK,      lambda: disk),
+                (co.CN_NET,       lambda: net),
+                (co.CN_DISKLOG10, lambda: np.log10(disk)),
+                (co.CN_NETLOG10,  lambda: np.log10(net)),
+                (co.CN_DUTIL,     lambda: 100 * disk / dtype(self.diskmax)),
+                (co.CN_NUTIL,     lambda: 100 * net / dtype(self.netmax))]:
+            if self.wants(coln):
+                raw_df[coln] = vals()
+        for coln, xcoln in [(co.CN_1M, co.CN_X1M), (co.CN_5M, co.CN_X5M), 
+                (co.CN_15M, co.CN_X15M)]:
+            if self.wants(xcoln):
+                raw_df[xcoln] = raw_df[coln]
+        if self.columns is not None:
+            for coln in list(raw_df.columns):
+                if coln not in self.columns:
+                    del raw_df[coln]
+        return raw_df
+
+    def _read_chunked(self):
+        '''Fill preallocated arrays chunk by chunk, one per column so that
+        every column keeps the dtype read() gives it without chunks. The row
+        count is taken from a cheap pass over the raw bytes, so the result is
+        allocated once and peak memory is the result plus one chunk.'''
+        nrows = max(count_lines(self.fpath) - 2, 0) # group and column header
+        arrays = None
+        index = np.empty(nrows, dtype='datetime64[ns]')
+        pos = 0
+        for chunk in self.iter_chunks():
+            if arrays is None:
+                columns = list(chunk.columns)
+                index_name = chunk.index.name
+                arrays = [np.empty(nrows, dtype=chunk[coln].dtype)
+                        for coln in columns]
+            end = pos + len(chunk)
+            if end > len(index): # file grew while reading
+                arrays = [np.resize(vals, end) for vals in arrays]
+                index = np.resize(index, end)
+            for i, coln in enumerate(columns):
+                vals = chunk[coln].values
+                # e.g. an int column that has NaNs in a later chunk only
+                dtype = np.promote_types(arrays[i].dtype, vals.dtype)
+                if dtype != arrays[i].dtype:
+                    arrays[i] = arrays[i].astype(dtype)
+                arrays[i][pos:end] = vals
+            index[pos:end] = chunk.index.values
+            pos = end
+        if arrays is None:
+            return self._derive(self._parse_index(self._read_csv()))
+        return _frame_from_columns([vals[:pos] for vals in arrays],
+                pan.DatetimeIndex(index[:pos], name=index_name), columns)
 
 
 class PowerLogReader(LogReader):
-    def __init__(self, fpath='', source='', test=''):
+    '''Reads pwrsmplr logs. If columns is given, only those columns are
+    parsed, as float32.'''
+    def __init__(self, fpath='', source='', test='', columns=None):
         super(PowerLogReader, self).__init__(fpath, source, test)
         self.timef = formatdefs.pwrsmplr_timef
+        self.columns = columns
 
+    def cache_params(self):
+        params = super(PowerLogReader, self).cache_params()
+        if self.columns is not None:
+            params.update(columns=sorted(self.columns))
+        return params
+
+    @cached
     def read(self):
         assert self.fpath != ''
-        self.log = pan.read_csv(self.fpath, parse_dates=0, index_col='timestamp')
+        self.log = self._read_csv(self.fpath)
         #self.log = self.log.resample('S', how='median')
 
+    def poll(self):
+        '''Follow mode, see DstatLogReader.poll()'''
+        assert self.fpath != ''
+        text = self.tail()
+        if text is None:
+            return None
+        chunk = self._read_csv(io.BytesIO(text))
+        self.append_polled(chunk)
+        return chunk
+
+    def _read_csv(self, src):
+        kwargs = dict()
+        if self.columns is not None:
+            kwargs.update(usecols=['timestamp'] + list(self.columns),
+                    dtype=dict((coln, np.float32) for coln in self.columns))
+        return pan.read_csv(src, parse_dates=['timestamp'], 
+                index_col='timestamp', **kwargs)
+
 class VideoSizesReader(LogReader):
     def __init__(self, fpath='', source='', test=''):
         super(VideoSizesReader, self).__init__(fpath, source, test)
 
+    def cache_params(self):
+        params = super(VideoSizesReader, self).cache_params()
+        params.update(source=self.source)
+        return params
+
+    @cached
     def read(self):
         assert self.fpath != ''
         if self.source == 'D':
@@ -165,7 +563,16 @@ class VideoSizesReader(LogReader):
 
 
 class ClientLogReader(LogReader):
-    def __init__(self, fpath='', source='', test=''):
+    '''Reads request logs of the load generators.
+
+    Parameters
+    ----------
+    arate_window : number, optional
+        Width of a sliding window in seconds. If given, the arate column holds
+        the rounded arrival rate within the window preceding each request
+        instead of the rate averaged over the whole log.
+    '''
+    def __init__(self, fpath='', source='', test='', arate_window=None):
         super(ClientLogReader, self).__init__(fpath, source, test)
         self.TASK = 'task'
         self.FNAM = co.CN_FNAME
@@ -179,30 +586,49 @@ class ClientLogReader(LogReader):
         self._raw_names = [self.TASK, self.FNAM, self.DTIM, self.TRSZ,
                 self.WAIT, self.DLTM, self.STAT]
         self._raw_dtypes = {self.TASK: str, self.FNAM: str, self.DTIM: str, 
-                self.TRSZ: np.uint64, self.WAIT: np.float16, self.DLTM: np.float16, 
+                self.TRSZ: np.uint64, self.WAIT: np.float32, self.DLTM: np.float32, 
                 self.STAT: np.uint16}
+        #task and status are not part of the log
+        self._used_names = [self.FNAM, self.DTIM, self.TRSZ, self.WAIT,
+                self.DLTM]
         self.timef = formatdefs.clientlog_timef
+        self.arate_window = arate_window
+
+    def cache_params(self):
+        params = super(ClientLogReader, self).cache_params()
+        if self.arate_window is not None:
+            params.update(arate_window=self.arate_window)
+        return params
 
+    @cached
     def read(self):
         assert self.fpath != ''
+        dtypes = dict((coln, self._raw_dtypes[coln]) for coln in 
+                self._used_names if coln != self.DTIM)
         raw_df = pan.read_csv(self.fpath, header=None, names=self._raw_names,
+                usecols=self._used_names, dtype=dtypes,
                 parse_dates=[self.DTIM], index_col=self.DTIM)
 
-        vidn_ser = raw_df[self.FNAM].apply(lambda x: x[0:4])
-        dtms = raw_df.index.values#[self.DTIM].apply(lambda x: dt.datetime.strptime(x,
-            #self.timef)).values
-        
-        iats = [op.sub(*l).item()/1.0e+9 for l in zip(dtms[1:], 
-            dtms[0:len(dtms)]) ]
-        iats = [1.] + iats
-        iats_ser = pan.Series(iats, index=raw_df.index)
+        vidn_ser = pan.Series(get_prefix_categorical(raw_df[self.FNAM], 4),
+                index=raw_df.index)
+        vidn_ser.name = self.FNAM
+        del raw_df[self.FNAM]
+        dtms = raw_df.index.values
+
+        iats_ser = pan.Series(get_iats(dtms), index=raw_df.index)
         iats_ser.name = self.IATS
-        
-        arate =  round(len(iats)/sum(iats))
-        arate_ser = pan.Series(np.full(len(iats), arate), index=raw_df.index)
+
+        if self.arate_window is None:
+            arate = np.round(len(iats_ser)/iats_ser.sum())
+            arates = np.full(len(iats_ser), arate)
+        else:
+            arates = np.round(get_sliding_arates(dtms, self.arate_window))
+        arate_ser = pan.Series(arates.astype(np.float32), index=raw_df.index)
         arate_ser.name = self.ARAT
 
-        trsz_log10_ser = np.log10(raw_df[co.CN_TRSZ])
+        trsz_log10_ser = pan.Series(
+                np.log10(raw_df[co.CN_TRSZ].values).astype(np.float32),
+                index=raw_df.index)
         trsz_log10_ser.name = co.CN_TRSZLOG10
 
         self.log = pan.concat([
@@ -216,17 +642,26 @@ class ClientLogReader(LogReader):
 
 
 class TCLogReader(ClientLogReader):
-    def __init__(self, fpath='', source='', tcont='flv', test=''):
-        super(TCLogReader, self).__init__(fpath, source, test)
+    def __init__(self, fpath='', source='', tcont='flv', test='', 
+            arate_window=None):
+        super(TCLogReader, self).__init__(fpath, source, test, arate_window)
         self._tcont = tcont
 
     @property
     def tcont(self):
         return self._tcont
 
+    def cache_params(self):
+        params = super(TCLogReader, self).cache_params()
+        params.update(tcont=self.tcont)
+        return params
+
+    @cached
     def read(self):
         super(TCLogReader, self).read()
-        tcont_ser = pan.Series([self.tcont]*len(self.log),
+        # one category and int8 codes instead of a string per row
+        tcont_ser = pan.Series(pan.Categorical.from_codes(
+                np.zeros(len(self.log), dtype=np.int8), [self.tcont]),
                 index=self.log.index)
         tcont_ser.name = 'tcont'
         self.log = self.log.join(tcont_ser)
@@ -248,7 +683,15 @@ class BMLogReader(LogReader):
         if t_id == co.BMK or t_id == co.TCBMK:
             self.source = t_id
 
+    #e.g. 'runspec finished at Thu Apr  2 10:20:31 2015; 1234 total seconds'
+    _finished_re = re.compile(r'runspec finished \S+ \S+ +(\S+) +(\d+) '
+            r'(\d+):(\d+):(\d+) +(\d+)\S* +(\d+)')
+    _months = dict((m, i + 1) for i, m in enumerate(['Jan', 'Feb', 'Mar', 
+        'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']))
+
     def read(self):
+        '''Scans the xlog line by line and keeps only the 'runspec finished'
+        lines. Returns datatypes.TestsetLog'''
         assert self.fpath != ''
         if not self.source:
             self.extract_task()
@@ -257,17 +700,26 @@ class BMLogReader(LogReader):
 
         testsets = list()
         with open(self.fpath) as xlog:
-            for line in xlog.readlines():
-                if line.startswith('runspec finished'):
+            for line in xlog:
+                if not line.startswith('runspec finished'):
+                    continue
+                match = self._finished_re.match(line)
+                if match is None or match.group(1) not in self._months:
                     comps = line.strip().split()
-                    dt_str = ' '.join(comps[3:8])
-                    dt = dup.parse(dt_str)
-                    e_time = dt - timedelta(microseconds=1)
-                    s_time = dt - timedelta(seconds=int(comps[8]), microseconds=1)
-                    msg = ' '.join([self.source, self.bmk,
-                        s_time.strftime(formatdefs.default_timef)])
-                    testsets.append(Testset(s_time, e_time, msg))
+                    finished = dup.parse(' '.join(comps[3:8]))
+                    secs = int(comps[8])
+                else:
+                    mon, day, hh, mm, ss, year, secs = match.groups()
+                    finished = dt.datetime(int(year), self._months[mon], 
+                            int(day), int(hh), int(mm), int(ss))
+                    secs = int(secs)
+                e_time = finished - dt.timedelta(microseconds=1)
+                s_time = finished - dt.timedelta(seconds=secs, microseconds=1)
+                msg = ' '.join([self.source, self.bm,
+                    s_time.strftime(formatdefs.default_timef)])
+                testsets.append(Testset(s_time, e_time, msg))
         self.log = TestsetLog(testsets)
+        return self.log
 
 
 class TestsetLogReader(LogReader):
@@ -280,13 +732,64 @@ class TestsetLogReader(LogReader):
 
         self.log = pan.read_csv(self.fpath, parse_dates=[0], header=None)
 
-        testsets = []
-        for i in range(0, len(self.log) - 1, 2):
-            stime, smsg, s = self.log.irow(i)
-            etime, emsg, e = self.log.irow(i + 1)
-            assert smsg == emsg
-            testsets.append( Testset(stime, etime, smsg) )
-        return TestsetLog(testsets)
+        # rows alternate between start and end of a testset
+        npairs = len(self.log) // 2
+        starts = self.log.iloc[0:2 * npairs:2]
+        ends = self.log.iloc[1:2 * npairs:2]
+        smsgs = starts.iloc[:, 1].values
+        assert (smsgs == ends.iloc[:, 1].values).all()
+        return TestsetLog.from_arrays(starts.iloc[:, 0].values, 
+                ends.iloc[:, 0].values, smsgs)
+
+def get_prefix_categorical(ser, n):
+    '''Categorical of the first n characters of each string in ser. Slicing
+    is done once per distinct value, not per row.'''
+    full = pan.Categorical(ser.values)
+    prefixes = np.array([c[0:n] for c in full.categories], dtype=object)
+    cats, codes = np.unique(prefixes, return_inverse=True)
+    codes = np.append(codes, -1) # NaN has code -1 in full
+    return pan.Categorical.from_codes(codes[full.codes], cats)
+
+def get_iats(dtms):
+    '''Inter-arrival times in seconds of sorted datetime64 values. The first
+    request is assigned an inter-arrival time of 1 s.'''
+    iats = np.empty(len(dtms), dtype=np.float64)
+    if len(dtms):
+        iats[0] = 1.
+        iats[1:] = np.diff(dtms).astype('timedelta64[ns]').astype(np.int64)
+        iats[1:] /= 1.0e+9
+    return iats
+
+def get_sliding_arates(dtms, window):
+    '''Arrival rate in 1/s over the window seconds preceding (and including)
+    each of the sorted datetime64 values. Within the first window seconds
+    the count is divided by the time elapsed since the first value instead,
+    it is NaN where no time has elapsed yet.'''
+    dtms = np.asarray(dtms, dtype='datetime64[ns]')
+    if not len(dtms):
+        return np.empty(0)
+    width = np.timedelta64(int(window * 1e9), 'ns')
+    spans = np.minimum(dtms - dtms[0], width)
+    starts = np.searchsorted(dtms, dtms - spans, side='right')
+    # count up to the last value of the same time, thus ties get equal rates
+    ends = np.searchsorted(dtms, dtms, side='right')
+    secs = spans.astype(np.int64) / 1e9
+    secs[secs == 0] = np.nan
+    return (ends - starts) / secs
+
+def count_lines(fpath, bufsize=1 << 20):
+    '''Count the lines of a file without decoding it.'''
+    lines = 0
+    last = '\n'
+    with open(fpath, 'rb') as f:
+        buf = f.read(bufsize)
+        while buf:
+            lines += buf.count('\n')
+            last = buf[-1]
+            buf = f.read(bufsize)
+    if last != '\n':
+        lines += 1
+    return lines
 
 def get_task_datetime_slots(dirn):
     comps = dirn.split('_')
@@ -304,3 +807,79 @@ def get_task_datetime_slots(dirn):
             runtimes.append( int( comps[offs + i + 3] ))
     runtimes = map(lambda x: str(x), runtimes)
     return dt_str, runtimes
+
+
+def discover_logs(expdir, task):
+    '''Find the logs of one experiment directory.
+
+    The resource usage (dstat) and power logs of the task's host
+    (co.MACH_MAP) are expected in co.MEAS_DIRN/co.RUK_DIRN and
+    co.MEAS_DIRN/co.PWRK_DIRN, the client logs (named after the task) and
+    the video size lists (co.VSZ_PTNS) in co.MEAS_DIRN/co.WLK_DIRN.
+
+    Returns
+    -------
+    list of (key, reader class, constructor kwargs), key being one of
+    co.RUK, co.PWRK, co.WLK and co.VSZK
+    '''
+    dt_str, runtimes = get_task_datetime_slots(osp.basename(
+        osp.normpath(expdir)))
+    year = int(dt_str[0:4]) if dt_str[0:4].isdigit() else ''
+    host = co.MACH_MAP[task]
+    meas_dir = osp.join(expdir, co.MEAS_DIRN)
+    find = lambda dirn, ptn: sorted(glob.glob(osp.join(meas_dir, dirn, ptn)))
+
+    specs = list()
+    for fpath in find(co.RUK_DIRN, host + '*'):
+        specs.append((co.RUK, DstatLogReader, 
+            dict(fpath=fpath, source=task, year=year, test=dt_str)))
+    for fpath in find(co.PWRK_DIRN, host + '*'):
+        specs.append((co.PWRK, PowerLogReader,
+            dict(fpath=fpath, source=task, test=dt_str)))
+    for fpath in find(co.WLK_DIRN, task + '*.log'):
+        kwargs = dict(fpath=fpath, source=task, test=dt_str)
+        if task == co.TCK:
+            tconts = [t for t in co.TCONTS if t in osp.basename(fpath)]
+            if tconts:
+                kwargs.update(tcont=tconts[0])
+            specs.append((co.WLK, TCLogReader, kwargs))
+        else:
+            specs.append((co.WLK, ClientLogReader, kwargs))
+    if task in co.VSZ_PTNS:
+        for fpath in find(co.WLK_DIRN, co.VSZ_PTNS[task]):
+            specs.append((co.VSZK, VideoSizesReader,
+                dict(fpath=fpath, source=task, test=dt_str)))
+    return specs
+
+def _read_spec(spec):
+    key, reader_cls, kwargs, cache_dir = spec
+    reader = reader_cls(**kwargs)
+    reader.cache_dir = cache_dir
+    reader.read()
+    return key, reader
+
+def read_experiment(expdir, task, processes=None):
+    '''Read all logs found by discover_logs() concurrently in a process
+    pool of processes workers (default: number of cores). The current
+    LogReader.cache_dir is used by the workers as well.
+
+    Returns
+    -------
+    dict mapping co.RUK, co.PWRK, co.WLK and co.VSZK to lists of readers
+    whose log has been read
+    '''
+    specs = [spec + (LogReader.cache_dir,) for spec in 
+            discover_logs(expdir, task)]
+    if processes == 1 or len(specs) < 2:
+        results = map(_read_spec, specs)
+    else:
+        pool = mp.Pool(processes)
+        try:
+            results = pool.map(_read_spec, specs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    readers = dict()
+    for key, reader in results:
+        readers.setdefault(key, list()).append(reader)
+    return readers
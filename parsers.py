@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 
 import datetime as dt
+import numpy as np
 import formatdefs
 
 
@@ -19,3 +20,52 @@ class DstatTimeParser:
    def parse(self, dstring):
        return dt.datetime.strptime(dstring, formatdefs.dstat_timef).replace(self.year)
 
+   def parse_array(self, dstrings, prev=None):
+       '''Vectorized version of parse() for a whole column of dstat time
+       strings in formatdefs.dstat_timef, i.e. 'dd-mm HH:MM:SS'.
+
+       Digits are picked from their fixed positions in the byte buffer, thus
+       no Python-level call per row is necessary. Since dstat does not log the
+       year, self.year is assumed for the first row and is incremented every
+       time the month decreases, i.e. the log crosses New Year.
+
+       Parameters
+       ----------
+       dstrings : array-like of strings
+       prev : datetime.datetime, optional
+           Timestamp of the row preceding dstrings[0] if the log is parsed in
+           chunks. Its year and month are carried over.
+
+       Returns
+       -------
+       numpy.ndarray of dtype datetime64[ns]
+       '''
+       width = len('dd-mm HH:MM:SS')
+       strs = np.asarray(dstrings, dtype='S%d' % width)
+       if len(strs) == 0:
+           return np.array([], dtype='datetime64[ns]')
+       if not (np.char.str_len(strs) == width).all():
+           # unexpected layout, fall back to the generic parser
+           return np.array([self.parse(s) for s in dstrings],
+                   dtype='datetime64[ns]')
+
+       digits = strs.view(np.uint8).reshape(-1, width).astype(np.int64) \
+               - ord('0')
+       field = lambda i: 10 * digits[:, i] + digits[:, i + 1]
+       days = field(0)
+       months = field(3)
+       secs = 3600 * field(6) + 60 * field(9) + field(12)
+
+       year = self.year
+       rollover = np.zeros(len(months), dtype=np.int64)
+       rollover[1:] = months[1:] < months[:-1]
+       if prev is not None:
+           year = prev.year
+           rollover[0] = months[0] < prev.month
+       years = year + np.cumsum(rollover)
+
+       ym = (12 * (years - 1970) + months - 1).astype('datetime64[M]')
+       dates = ym.astype('datetime64[D]') + (days - 1).astype('timedelta64[D]')
+       stamps = dates.astype('datetime64[s]') + secs.astype('timedelta64[s]')
+       return stamps.astype('datetime64[ns]')
+
@@ -0,0 +1,380 @@
+# -*- coding: utf-8 -*-
+
+import re
+
+import numpy as np
+import pandas as pan
+import scipy.stats as sst
+
+_ident_re = re.compile(r'^[A-Za-z_][A-Za-z0-9_.]*$')
+_inter_re = re.compile(r'^([A-Za-z_][A-Za-z0-9_.]*):C\(([A-Za-z_][A-Za-z0-9_.]*)\)$')
+
+INTERCEPT = 'Intercept'
+
+
+def parse_formula(formula):
+    '''Parse the formula shapes used in constants.PREDS and
+    constants.COMBIPREDS: 'y ~ a', 'y ~ a + b + c' and 'y ~ a:C(b)', also
+    mixed as long as no factor of an interaction is a main effect as well.
+
+    Returns
+    -------
+    (response, terms) where every term is (numeric column, categorical
+    column or None)
+
+    Raises
+    ------
+    NotImplementedError for any other formula, to be handled by patsy
+    '''
+    sides = formula.split('~')
+    if len(sides) != 2:
+        raise NotImplementedError, 'not a regression formula: ' + formula
+    lhs = sides[0].strip()
+    if not _ident_re.match(lhs):
+        raise NotImplementedError, 'unsupported response: ' + lhs
+    terms = list()
+    for term in sides[1].split('+'):
+        term = term.replace(' ', '')
+        match = _inter_re.match(term)
+        if _ident_re.match(term):
+            terms.append((term, None))
+        elif match:
+            terms.append(match.groups())
+        else:
+            raise NotImplementedError, 'unsupported term: ' + term
+    mains = set(num for num, cat in terms if cat is None)
+    for num, cat in terms:
+        if cat is not None and (num in mains or cat in mains):
+            raise NotImplementedError, 'reduced coding not supported: ' + \
+                    formula
+    if len(set(terms)) != len(terms):
+        raise NotImplementedError, 'duplicate terms: ' + formula
+    return lhs, terms
+
+def _level_name(level):
+    if isinstance(level, basestring):
+        return level
+    return repr(level)
+
+def design_matrix(formula, data):
+    '''Response vector and design matrix for formula as patsy would build
+    them: intercept first, then main effects, then interactions, each
+    interaction a:C(b) with one column a * [b == level] per level of b. Rows
+    with NaNs in any used column are dropped.
+
+    Returns
+    -------
+    (y, X, column names, index of the used rows)
+    '''
+    lhs, terms = parse_formula(formula)
+    used = [lhs] + [coln for term in terms for coln in term if coln]
+    for coln in used:
+        if coln not in data.columns:
+            raise NotImplementedError, 'unknown column: ' + coln
+    nums = [num for num, _ in terms] + [lhs]
+    if any(data[coln].dtype.kind not in 'biuf' for coln in nums):
+        raise NotImplementedError, 'non-numeric column in ' + formula
+    keep = ~pan.isnull(data[used]).any(axis=1).values
+    y = data[lhs].values[keep].astype(np.float64)
+    cols = [np.ones(len(y))]
+    names = [INTERCEPT]
+    # patsy orders terms by degree
+    for num, cat in sorted(terms, key=lambda term: term[1] is not None):
+        x = data[num].values[keep].astype(np.float64)
+        if cat is None:
+            cols.append(x)
+            names.append(num)
+            continue
+        levels, codes = np.unique(data[cat].values[keep], return_inverse=True)
+        dummies = codes[:, np.newaxis] == np.arange(len(levels))
+        cols.extend((x[:, np.newaxis] * dummies).T)
+        names.extend('%s:C(%s)[%s]' % (num, cat, _level_name(level)) for
+                level in levels.tolist())
+    return y, np.column_stack(cols), names, data.index[keep]
+
+def hac_cov(X, resid, maxlags=0, pinv_X=None):
+    '''Newey-West HAC covariance of the OLS parameters with Bartlett weights
+    and without small sample correction, as statsmodels' cov_type='HAC'.
+    maxlags 0 yields White's (HC0) covariance.'''
+    if pinv_X is None:
+        pinv_X = np.linalg.pinv(X)
+    bread = np.dot(pinv_X, pinv_X.T)
+    xu = X * resid[:, np.newaxis]
+    S = np.dot(xu.T, xu)
+    for lag in range(1, maxlags + 1):
+        s = np.dot(xu[lag:].T, xu[:-lag])
+        S += (1 - lag / (maxlags + 1.)) * (s + s.T)
+    return np.dot(np.dot(bread, S), bread)
+
+
+class RegressionSummary(object):
+    '''Plain text summary, offers as_text() like statsmodels' Summary'''
+    def __init__(self, text):
+        self._text = text
+
+    def as_text(self):
+        return self._text
+
+    def __str__(self):
+        return self._text
+
+
+class RegressionResult(object):
+    '''Lightweight result of ols() and glsar(). Offers the attributes of
+    statsmodels' RegressionResults used by the evaluators: params, bse,
+    tvalues, pvalues, resid, fittedvalues, rsquared and summary(). Fit
+    statistics refer to the whitened data wy, wX if given.'''
+    model_name = 'OLS'
+    method = 'Least Squares'
+    use_t = False
+
+    def __init__(self, formula, y, X, names, index, params, cov, cov_type,
+            rank=None, wy=None, wX=None):
+        if wy is None:
+            wy, wX = y, X
+        self.formula = formula
+        self.endog_name = formula.split('~')[0].strip()
+        self.nobs = len(wy)
+        self.rank = np.linalg.matrix_rank(wX) if rank is None else rank
+        self.df_model = self.rank - 1
+        self.df_resid = self.nobs - self.rank
+        self.cov_type = cov_type
+        fitted = np.dot(X, params)
+        self.params = pan.Series(params, index=names)
+        self.fittedvalues = pan.Series(fitted, index=index)
+        self.resid = pan.Series(y - fitted, index=index)
+        self._cov = pan.DataFrame(cov, index=names, columns=names)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            self.bse = pan.Series(np.sqrt(np.diag(cov)), index=names)
+            self.tvalues = self.params / self.bse
+            self.pvalues = pan.Series(2 * self._dist().sf(np.abs(
+                self.tvalues)), index=names)
+            wresid = wy - np.dot(wX, params)
+            centered = wy - wy.mean()
+            self.ssr = np.dot(wresid, wresid)
+            self.rsquared = 1 - self.ssr / np.dot(centered, centered)
+            self.rsquared_adj = 1 - (self.nobs - 1.) / self.df_resid * \
+                    (1 - self.rsquared)
+
+    def _dist(self):
+        if self.use_t:
+            return sst.t(self.df_resid)
+        return sst.norm
+
+    def cov_params(self):
+        return self._cov
+
+    def conf_int(self, alpha=0.05):
+        q = self._dist().ppf(1 - alpha / 2.)
+        return pan.DataFrame({0: self.params - q * self.bse,
+            1: self.params + q * self.bse}, columns=[0, 1])
+
+    def _summary_info(self):
+        return [('Dep. Variable:', self.endog_name),
+                ('Model:', self.model_name),
+                ('Method:', self.method),
+                ('No. Observations:', str(self.nobs)),
+                ('Df Residuals:', str(self.df_resid)),
+                ('Df Model:', str(self.df_model)),
+                ('R-squared:', '%.3f' % self.rsquared),
+                ('Adj. R-squared:', '%.3f' % self.rsquared_adj),
+                ('Covariance Type:', self.cov_type)]
+
+    def summary(self):
+        width = 78
+        lines = ['%s Regression Results' % self.model_name, '=' * width]
+        lines.extend('%-24s%54s' % item for item in self._summary_info())
+        lines.append('=' * width)
+        namew = max([len(name) for name in self.params.index] + [10])
+        stat = 't' if self.use_t else 'z'
+        lines.append(' ' * namew + '%10s %10s %10s %10s %10s %10s' % ('coef',
+            'std err', stat, 'P>|%s|' % stat, '[0.025', '0.975]'))
+        lines.append('-' * width)
+        conf = self.conf_int()
+        for name in self.params.index:
+            lines.append(name.ljust(namew) +
+                    '%10.4f %10.3f %10.3f %10.3f %10.3f %10.3f' % (
+                        self.params[name], self.bse[name], self.tvalues[name],
+                        self.pvalues[name], conf.loc[name, 0],
+                        conf.loc[name, 1]))
+        lines.append('=' * width)
+        return RegressionSummary('\n'.join(lines))
+
+
+def ols(formula, data, maxlags=0):
+    '''OLS fit with Newey-West HAC covariance, the NumPy equivalent of
+    statsmodels.formula.api.ols(formula, data).fit(cov_type='HAC',
+    cov_kwds={'maxlags': maxlags, 'use_correction': False}) for the formulas
+    accepted by parse_formula().
+
+    Returns
+    -------
+    RegressionResult
+
+    Raises
+    ------
+    NotImplementedError if the formula is not supported
+    '''
+    y, X, names, index = design_matrix(formula, data)
+    pinv_X = np.linalg.pinv(X)
+    params = np.dot(pinv_X, y)
+    cov = hac_cov(X, y - np.dot(X, params), maxlags, pinv_X)
+    return RegressionResult(formula, y, X, names, index, params, cov, 'HAC')
+
+
+class GLSARResult(RegressionResult):
+    '''Result of glsar(), additionally offers the AR coefficients rho, the
+    number of iterations used and whether the fit converged.'''
+    model_name = 'GLSAR'
+    use_t = True
+
+    def __init__(self, formula, y, X, names, index, params, cov, rank, wy, wX,
+            rho, iterations, converged):
+        RegressionResult.__init__(self, formula, y, X, names, index, params,
+                cov, 'nonrobust', rank, wy, wX)
+        self.rho = rho
+        self.iter = int(iterations)
+        self.converged = bool(converged)
+
+    def _summary_info(self):
+        info = RegressionResult._summary_info(self)
+        info.append(('AR coefficients:', ' '.join('%.4f' % r for r in
+            self.rho)))
+        info.append(('Iterations:', '%d (%s)' % (self.iter, 'converged' if
+            self.converged else 'not converged')))
+        return info
+
+
+def _whiten(Y, rho):
+    '''Apply the AR(p) filter rho[j] (k x p) to the response Y[j] (k x n),
+    the first p values are dropped'''
+    order = rho.shape[1]
+    n = Y.shape[1]
+    wY = Y[:, order:].copy()
+    for i in range(order):
+        wY -= rho[:, i:i+1] * Y[:, order-i-1:n-i-1]
+    return wY
+
+def _whiten_design(X, rho):
+    '''Apply every AR(p) filter of rho (k x p) to the shared design X
+    (n x q), returns k x (n-p) x q'''
+    order = rho.shape[1]
+    n = X.shape[0]
+    wX = np.repeat(X[np.newaxis, order:], len(rho), axis=0)
+    for i in range(order):
+        wX -= rho[:, i, np.newaxis, np.newaxis] * X[np.newaxis, order-i-1:n-i-1]
+    return wX
+
+def _yule_walker(resid, order):
+    '''Adjusted Yule-Walker estimates of AR(order) coefficients, one row of
+    resid per fit, as statsmodels' yule_walker(x, order, method='adjusted')'''
+    x = resid - resid.mean(axis=1)[:, np.newaxis]
+    n = x.shape[1]
+    r = np.empty((len(x), order + 1))
+    r[:, 0] = (x ** 2).sum(axis=1) / n
+    for k in range(1, order + 1):
+        r[:, k] = (x[:, :-k] * x[:, k:]).sum(axis=1) / (n - k)
+    lags = np.abs(np.subtract.outer(np.arange(order), np.arange(order)))
+    R = r[:, lags]
+    try:
+        return np.linalg.solve(R, r[:, 1:, np.newaxis])[:, :, 0]
+    except np.linalg.LinAlgError:
+        return np.einsum('kij,kj->ki', np.linalg.pinv(R), r[:, 1:])
+
+def _glsar_step(Y, X, rho):
+    wY = _whiten(Y, rho)
+    wX = _whiten_design(X, rho)
+    pinv_wX = np.linalg.pinv(wX)
+    params = np.einsum('kpm,km->kp', pinv_wX, wY)
+    return params, Y - np.dot(params, X.T), wY, wX, pinv_wX
+
+def glsar_batch(Y, X, order=1, maxiter=6, rtol=1e-4):
+    '''Iterative Cochrane-Orcutt fits of many responses sharing one design
+    with AR(order) errors, solved as one batch per iteration. Follows
+    statsmodels' GLSAR(rho=order).iterative_fit(maxiter, rtol): an
+    iteration refits with the Yule-Walker estimate of rho from the last
+    residuals, a response stops once its parameters change by less than rtol
+    relatively.
+
+    Parameters
+    ----------
+    Y : numpy.ndarray k x n
+        One response per row
+    X : numpy.ndarray n x p
+        Shared design matrix
+
+    Returns
+    -------
+    (params k x p, rho k x order, iterations k, converged k, whitened Y,
+    whitened X, pseudo-inverses of whitened X)
+    '''
+    Y = np.atleast_2d(np.asarray(Y, dtype=np.float64))
+    k = len(Y)
+    rho = np.zeros((k, order))
+    last = np.empty((k, X.shape[1]))
+    iterations = np.zeros(k, dtype=np.int64)
+    converged = np.zeros(k, dtype=bool)
+    active = np.arange(k)
+    i = -1
+    for i in range(maxiter - 1):
+        params, resid = _glsar_step(Y[active], X, rho[active])[:2]
+        if i > 0:
+            with np.errstate(divide='ignore', invalid='ignore'):
+                diff = np.max(np.abs(last[active] - params) / 
+                        np.abs(last[active]), axis=1)
+            done = diff < rtol
+            converged[active[done]] = True
+            iterations[active[done]] = i + 1
+            active, params, resid = active[~done], params[~done], resid[~done]
+        last[active] = params
+        if len(active) == 0:
+            break
+        rho[active] = _yule_walker(resid, order)
+    iterations[~converged] = i + 2
+    params, _, wY, wX, pinv_wX = _glsar_step(Y, X, rho)
+    return params, rho, iterations, converged, wY, wX, pinv_wX
+
+def glsar_many(formulas, data, order=1, maxiter=6, rtol=1e-4):
+    '''glsar() for several formulas that share their right hand side, e.g.
+    one per response of a MeasurementDataContainer, fitted in one batch.
+
+    Returns
+    -------
+    list of GLSARResult
+
+    Raises
+    ------
+    NotImplementedError if a formula is not supported or the designs differ
+    '''
+    designs = [design_matrix(formula, data) for formula in formulas]
+    y, X, names, index = designs[0]
+    for _, X_i, _, index_i in designs[1:]:
+        if not (index_i.equals(index) and np.array_equal(X_i, X)):
+            raise NotImplementedError, 'formulas must share their design'
+    Y = np.vstack([design[0] for design in designs])
+    params, rho, iterations, converged, wY, wX, pinv_wX = glsar_batch(Y, X,
+            order, maxiter, rtol)
+    results = list()
+    for i, formula in enumerate(formulas):
+        rank = np.linalg.matrix_rank(wX[i])
+        wresid = wY[i] - np.dot(wX[i], params[i])
+        scale = np.dot(wresid, wresid) / (len(wresid) - rank)
+        cov = scale * np.dot(pinv_wX[i], pinv_wX[i].T)
+        results.append(GLSARResult(formula, Y[i], X, names, index, params[i],
+            cov, rank, wY[i], wX[i], rho[i], iterations[i], converged[i]))
+    return results
+
+def glsar(formula, data, order=1, maxiter=6, rtol=1e-4):
+    '''GLSAR fit with AR(order) errors, the NumPy equivalent of
+    statsmodels.formula.api.glsar(formula, data, rho=order).iterative_fit(
+    maxiter, rtol) for the formulas accepted by parse_formula().
+
+    Returns
+    -------
+    GLSARResult
+
+    Raises
+    ------
+    NotImplementedError if the formula is not supported
+    '''
+    return glsar_many([formula], data, order, maxiter, rtol)[0]
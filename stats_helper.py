@@ -1,60 +1,118 @@
 # -*- coding: utf-8 -*-
 
-import bisect
+import collections
+import hashlib
+import warnings
+
 import numpy as np
 import pandas as pan
 import scipy.stats.mstats as mst
 
 import constants as co
 
-def get_cdf(series):
-    '''Calculates the CDF for a pandas.Series'''
+def get_cdf(series, decimals=6):
+    '''Calculates the CDF for a pandas.Series
 
-    frqs = series.value_counts()/len(series)
-    cdf = frqs.sort_index().cumsum()
-    cdf = pan.Series(map(lambda x: round(x,6), cdf), index=cdf.index)
-    cdf.name = series.name
+    Parameters
+    ----------
+    series : pandas.Series
+    decimals : int or None
+        Probabilities are rounded to this many decimals, None disables
+        rounding.
+    '''
+    if series.dtype.kind not in 'biufmM':
+        return get_cdf_from_counts(series.value_counts(), len(series),
+                series.name, decimals)
+    return ECDF.from_series(series, decimals).to_series()
+
+def sorted_unique(vals):
+    '''Unique values of the sorted array vals and the number of elements up
+    to and including the last occurrence of each.'''
+    if len(vals) == 0:
+        return vals, np.array([], dtype=np.int64)
+    first = np.empty(len(vals), dtype=bool)
+    first[0] = True
+    np.not_equal(vals[1:], vals[:-1], out=first[1:])
+    starts = np.flatnonzero(first)
+    ends = np.append(starts[1:], len(vals))
+    return vals[starts], ends
+
+def get_cdf_from_counts(counts, n, name=None, decimals=6):
+    '''Calculates the CDF from the value counts of n samples, e.g. as
+    maintained by datatypes.MeasurementData.extend()'''
+    counts = counts.sort_index()
+    cdf = pan.Series(_round(counts.values.cumsum() / float(n), decimals),
+            index=counts.index)
+    cdf.name = name
     return cdf
 
-def get_ccdf(series):
+def _round(vals, decimals):
+    if decimals is None:
+        return vals
+    return np.round(vals, decimals, out=vals)
+
+def get_ccdf(series, decimals=6):
     '''Calculates the CCDF for a pandas.Series'''
-    return 1 - get_cdf(series)
+    return 1 - get_cdf(series, decimals)
 
 def get_inv_cdf(cdf):
     '''Calculate the inverse of an empirial CDF.
 
     Parameters
     ----------
-    cdf : outcome of get_cdf(pandas.Series)
+    cdf : outcome of get_cdf(pandas.Series) or ECDF
 
     Returns
     -------
     pandas.Series with index and values swapped
     '''
-    cdf_inv =  pan.Series(map(lambda x: np.float64(x), cdf.index), 
+    if isinstance(cdf, ECDF):
+        return cdf.to_inv_series()
+    cdf_inv =  pan.Series(cdf.index.values.astype(np.float64), 
             index=cdf.values)
     cdf_inv.name = cdf.name
     return cdf_inv
 
 def get_quantile(cdf, p):
-    idx = bisect.bisect_left(cdf.values, p)
-    return cdf.index[idx]
+    '''Smallest value whose cumulative probability is at least p. p may be
+    a scalar or an array of probabilities.
+
+    Parameters
+    ----------
+    cdf : outcome of get_cdf(pandas.Series) or ECDF
+    '''
+    return as_ecdf(cdf).quantile(p)
+
+def as_ecdf(cdf):
+    '''Wrap the outcome of get_cdf() in an ECDF without sorting again.'''
+    if isinstance(cdf, ECDF):
+        return cdf
+    return ECDF(cdf.index.values, cdf.values, cdf.name)
 
 
 def estimate_quantiles(dep_ser, pred_quantiles=None):
+    '''Estimate the quantiles of dep_ser for all pred_quantiles with a
+    single binary search.
+
+    Parameters
+    ----------
+    dep_ser : pandas.Series or ECDF
+    pred_quantiles : array-like of probabilities, 0, .001, ..., 1 by default
+
+    Returns
+    -------
+    pandas.Series probability -> quantile
+    '''
     if pred_quantiles is None:
         pred_quantiles = np.arange(0,1.001,.001)
-    assert len(dep_ser) >= 2
     ## treat categorical variable specially
     ## TODO Move string to constants
     #if dep_ser.name == 'arate':
-    dep_qf = get_inv_cdf(get_cdf(dep_ser))
-    idx_poz = list()
-    dep_est_quants = list()
-    for prob in pred_quantiles:
-        idx_poz.append(bisect.bisect_left(dep_qf.index, prob))
-    for idx_pos in idx_poz:
-        dep_est_quants.append(dep_qf.iget(idx_pos))
+    if isinstance(dep_ser, ECDF):
+        dep_ecdf = dep_ser
+    else:
+        assert len(dep_ser) >= 2
+        dep_ecdf = ECDF.from_series(dep_ser)
 
     # TODO predictors should also be MeasurementData type or the like so save
     # computing of STD
@@ -64,45 +122,275 @@ def estimate_quantiles(dep_ser, pred_quantiles=None):
     #else:
         #dep_est_quants = mst.mquantiles(dep_ser, pred_quantiles, alphap=1/3,
                 #betap=1/3)
-    #print len(set(dep_est_quants))
+    dep_est_quants = dep_ecdf.quantile(pred_quantiles).astype(np.float64)
     dep_est_qf = pan.Series(dep_est_quants, pred_quantiles)
-    dep_est_qf.name = dep_ser.name
+    dep_est_qf.name = dep_ecdf.name
 
     return dep_est_qf
 
-def rv_sum(sample1, sample2, n=1000000):
-    sample1 = np.random.choice(sample1, n)
-    sample2 = np.random.choice(sample2, n)
-    sum = sample1 + sample2
-    if type(sample1) == pan.Series and type(sample2) == pan.Series:
-        sum_ser = pan.Series(sum)
-        sum_ser.name = '(' + sample1.name + '+' + sample2.name + ')'
-        return pan.Series(sum_ser)
+def estimate_quantiles_df(dep_df, pred_quantiles=None):
+    '''estimate_quantiles() for every column of a pandas.DataFrame. NaNs are
+    dropped per column.
+
+    Returns
+    -------
+    pandas.DataFrame probability -> quantile, one column per column of
+    dep_df
+    '''
+    if pred_quantiles is None:
+        pred_quantiles = np.arange(0,1.001,.001)
+    quants = np.empty((len(pred_quantiles), len(dep_df.columns)), 
+            dtype=np.float64)
+    for i, coln in enumerate(dep_df.columns):
+        ecdf = ECDF.from_series(dep_df[coln].dropna())
+        assert len(ecdf) > 0
+        quants[:, i] = ecdf.quantile(pred_quantiles)
+    return pan.DataFrame(quants, index=pred_quantiles, columns=dep_df.columns)
+
+def quantile_grid(steps=30, start=0.001, tails=0.):
+    '''Strictly increasing probability grid from start to 1 with steps points.
+
+    Parameters
+    ----------
+    tails : float in [0, 1]
+        0 gives the uniform grid np.linspace(0, 1, steps) with its first point
+        set to start, as used by EDFRegressionEvaluator so far. Larger values
+        move points into both tails (cosine spacing at 1), the warped grid is
+        mapped onto [start, 1].
+    '''
+    u = np.linspace(0, 1, steps)
+    if tails == 0:
+        q_ords = u
+        q_ords[0] = start
     else:
-        return sum
+        warped = (1 - tails) * u + tails * (1 - np.cos(np.pi * u)) / 2.
+        q_ords = start + (1 - start) * warped
+    assert np.all(np.diff(q_ords) > 0), 'probability grid not increasing'
+    return q_ords
+
+class QuantileCache(object):
+    '''LRU cache of the ECDFs behind estimated quantiles, keyed by the
+    content of the series. The data is sorted once, quantiles for any grid,
+    coarse, fine or non-uniform, are looked up from the cached ECDF. Thus, a
+    predictor or response shared by many models and grids is only processed
+    once.
 
-def rv_diff(sample1, sample2, n=1000000):
-    smpl1 = np.random.choice(sample1, n)
-    smpl2 = np.random.choice(sample2, n)
-    diff = smpl1 - smpl2
+    Parameters
+    ----------
+    maxsize : int
+        Number of ECDFs kept, the least recently used is evicted first
+    maxbytes : int
+        Bound on the total size of the cached ECDFs in bytes. An ECDF larger
+        than this is not cached at all.
+    '''
+    def __init__(self, maxsize=128, maxbytes=64 * 2**20):
+        self._maxsize = maxsize
+        self._maxbytes = maxbytes
+        self._entries = collections.OrderedDict()
+        self._nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def maxsize(self):
+        return self._maxsize
+
+    @property
+    def maxbytes(self):
+        return self._maxbytes
+
+    @property
+    def nbytes(self):
+        return self._nbytes
+
+    def __len__(self):
+        return len(self._entries)
+
+    def clear(self):
+        self._entries.clear()
+        self._nbytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def info(self):
+        return {'hits': self.hits, 'misses': self.misses, 'size': len(self),
+                'maxsize': self.maxsize, 'nbytes': self.nbytes,
+                'maxbytes': self.maxbytes}
+
+    @staticmethod
+    def series_key(series):
+        '''Content hash of a pandas.Series, including its name'''
+        vals = series.values
+        digest = hashlib.sha1(str(series.name))
+        digest.update(str(vals.dtype))
+        if vals.dtype.kind in 'biufmM':
+            digest.update(np.ascontiguousarray(vals).tobytes())
+        else:
+            digest.update('\0'.join(str(val) for val in vals))
+        return digest.hexdigest()
+
+    def ecdf(self, series):
+        '''Cached ECDF.from_series(series)'''
+        key = self.series_key(series)
+        try:
+            ecdf = self._entries.pop(key)
+            self.hits += 1
+        except KeyError:
+            ecdf = ECDF.from_series(series)
+            self.misses += 1
+            size = self._size(ecdf)
+            if size > self.maxbytes:
+                return ecdf # would evict every other entry, bypass the cache
+            self._nbytes += size
+        self._entries[key] = ecdf
+        while self._entries and (len(self._entries) > self.maxsize or 
+                self._nbytes > self.maxbytes):
+            self._nbytes -= self._size(self._entries.popitem(last=False)[1])
+        return ecdf
+
+    @staticmethod
+    def _size(ecdf):
+        return ecdf.xs.nbytes + ecdf.ps.nbytes
+
+    def quantiles(self, dep_ser, pred_quantiles):
+        '''Cached estimate_quantiles(dep_ser, pred_quantiles)'''
+        assert len(dep_ser) >= 2
+        return estimate_quantiles(self.ecdf(dep_ser), pred_quantiles)
+
+    def quantiles_df(self, dep_df, pred_quantiles):
+        '''Cached estimate_quantiles_df(dep_df, pred_quantiles), column by
+        column'''
+        quants = np.empty((len(pred_quantiles), len(dep_df.columns)), 
+                dtype=np.float64)
+        for i, coln in enumerate(dep_df.columns):
+            ecdf = self.ecdf(dep_df[coln].dropna())
+            assert len(ecdf) > 0
+            quants[:, i] = ecdf.quantile(pred_quantiles)
+        return pan.DataFrame(quants, index=pred_quantiles, 
+                columns=dep_df.columns)
+
+def rv_sum(sample1, sample2, n=1000000, method='mc', seed=None, 
+        chunksize=100000, bins=4096, rel_acc=0.01):
+    '''Distribution of the sum of two independent random variables given by
+    samples (or ECDFs for method 'exact').
+
+    Parameters
+    ----------
+    method : string
+        'mc' draws n values of each sample and returns the n sums as
+        numpy.ndarray, or as pandas.Series if both samples are Series.
+        'chunked' draws the same in chunks of chunksize and returns a
+        QuantileSketch with relative accuracy rel_acc, thus memory stays
+        bounded. 'exact' convolves both ECDFs on a common grid of about bins
+        points via FFT and returns an ECDF.
+    seed : int, optional
+        Seed for the Monte Carlo methods, for reproducible results. By
+        default, the global numpy.random state is used.
+    '''
+    return _rv_combine(sample1, sample2, 1, '+', n, method, seed, chunksize,
+            bins, rel_acc)
+
+def rv_diff(sample1, sample2, n=1000000, method='mc', seed=None,
+        chunksize=100000, bins=4096, rel_acc=0.01):
+    '''Distribution of the difference of two independent random variables,
+    see rv_sum()'''
+    return _rv_combine(sample1, sample2, -1, ' - ', n, method, seed, 
+            chunksize, bins, rel_acc)
+
+def _rv_combine(sample1, sample2, sign, op_str, n, method, seed, chunksize,
+        bins, rel_acc):
+    name = None
     if type(sample1) == pan.Series and type(sample2) == pan.Series:
-        diff_ser = pan.Series(diff)
-        diff_ser.name = '(' + sample1.name + ' - ' + sample2.name + ')'
-        return pan.Series(diff_ser)
+        name = '(' + str(sample1.name) + op_str + str(sample2.name) + ')'
+    elif isinstance(sample1, ECDF) and isinstance(sample2, ECDF):
+        name = '(' + str(sample1.name) + op_str + str(sample2.name) + ')'
+    if method == 'exact':
+        return _convolve_ecdfs(_sample_ecdf(sample1), _sample_ecdf(sample2),
+                sign, bins, name)
+    # without seed, draw from the global generator so that np.random.seed()
+    # still makes results reproducible
+    rs = np.random if seed is None else np.random.RandomState(seed)
+    vals1 = np.asarray(sample1)
+    vals2 = np.asarray(sample2)
+    if method == 'mc':
+        comb = rs.choice(vals1, n) + sign * rs.choice(vals2, n)
+        if name is None:
+            return comb
+        comb_ser = pan.Series(comb)
+        comb_ser.name = name
+        return comb_ser
+    elif method == 'chunked':
+        sketch = QuantileSketch(rel_acc, name)
+        for start in range(0, n, chunksize):
+            k = min(chunksize, n - start)
+            sketch.add(rs.choice(vals1, k) + sign * rs.choice(vals2, k))
+        return sketch
     else:
-        return diff
-
-def rvs_from_cdf(cdf):
-    steps = np.append(np.array(cdf.values[0]), np.diff(cdf.values))
-    min_step = min(steps)
-    #print 'min step', min_step, 'in', len(steps), 'steps'
-    step_incs = np.int16(np.round(steps / min_step))
-    l = list()
-    for e, m in zip(cdf.keys(), step_incs):
-        for i in range(m):
-            l.append(e)
-    rv_ser = pan.Series(l)
-    rv_ser.name = cdf.name
+        raise NotImplementedError, 'unknown method ' + str(method)
+
+def _sample_ecdf(sample):
+    if isinstance(sample, ECDF):
+        return sample
+    return ECDF.from_series(pan.Series(sample).dropna(), decimals=None)
+
+def _convolve_ecdfs(ecdf1, ecdf2, sign, bins, name):
+    '''ECDF of X1 + sign * X2 for independent X1 and X2. Both probability
+    mass functions are put on a common grid and convolved via FFT, so the
+    result is exact up to the grid spacing.'''
+    x1 = ecdf1.xs.astype(np.float64)
+    p1 = np.diff(np.append(0., ecdf1.ps))
+    x2 = ecdf2.xs.astype(np.float64)
+    p2 = np.diff(np.append(0., ecdf2.ps))
+    if sign < 0:
+        x2, p2 = -x2[::-1], p2[::-1]
+    span = (x1[-1] - x1[0]) + (x2[-1] - x2[0])
+    h = span / float(bins) if span > 0 else 1.
+    pmfs = list()
+    for xs, ps in [(x1, p1), (x2, p2)]:
+        idx = np.round((xs - xs[0]) / h).astype(np.int64)
+        pmfs.append(np.bincount(idx, weights=ps, minlength=idx[-1] + 1))
+    nconv = len(pmfs[0]) + len(pmfs[1]) - 1
+    nfft = 1 << int(np.ceil(np.log2(nconv)))
+    pmf = np.fft.irfft(np.fft.rfft(pmfs[0], nfft) * 
+            np.fft.rfft(pmfs[1], nfft), nfft)[:nconv]
+    pmf[pmf < 1e-12] = 0. # FFT round-off
+    pmf /= pmf.sum()
+    keep = pmf > 0
+    xs = x1[0] + x2[0] + h * np.arange(nconv)
+    ps = np.cumsum(pmf)[keep]
+    ps[-1] = 1.
+    return ECDF(xs[keep], ps, name)
+
+def rvs_from_cdf(cdf, size=None):
+    '''Reconstruct a sample from a CDF by repeating every value according to
+    its probability step.
+
+    Parameters
+    ----------
+    cdf : outcome of get_cdf() or ECDF
+    size : int, optional
+        Target sample size. By default, the smallest positive step is taken
+        as one sample.
+
+    Returns
+    -------
+    pandas.Series
+    '''
+    ecdf = as_ecdf(cdf)
+    steps = np.diff(np.append(0., ecdf.ps))
+    steps[steps < 0] = 0.
+    if size is None:
+        min_step = steps[steps > 0].min()
+        step_incs = np.round(steps / min_step).astype(np.int64)
+    else:
+        # largest remainder method, so that the sample has exactly size values
+        exact = steps * (size / steps.sum())
+        step_incs = np.floor(exact).astype(np.int64)
+        missing = int(size - step_incs.sum())
+        if missing > 0:
+            step_incs[np.argsort(step_incs - exact)[:missing]] += 1
+    rv_ser = pan.Series(np.repeat(ecdf.xs, step_incs))
+    rv_ser.name = ecdf.name
     return rv_ser
 
 def percentile_diffs(minuends, subtrahends):
@@ -146,82 +434,95 @@ def quantile_mpe(orig_ser, fit_ser):
     mpe = qp.cumsum()[[qp.last_valid_index()]] * (100./len(qp))
     return mpe.values[0]
 
+ERR_COLUMNS = [co.ERR_AMAX, co.ERR_AAVG, co.ERR_AMED, co.ERR_PMAX, co.ERR_PAVG,
+        co.ERR_PMED]
+
 def model_errors_by_shiftfun(band_u, band_l):
-    '''Compute max, min, mean, and mean percentage errors of a model as computed
-    by the empirical shift function.'''
-    os_l = map(lambda x: float(x), band_l.index.values)
-    os_u = map(lambda x: float(x), band_u.index.values)
-    eas_l = map(lambda x: abs(x), band_l.values)
-    eas_u = map(lambda x: abs(x), band_u.values)
-    eaps_l = map(lambda (o, e): 100 * e/o, filter(lambda (o, e): o > 0,
-        zip(os_l, eas_l)))
-    eaps_u = map(lambda (o, e): 100 * e/o, filter(lambda (o, e): o > 0,
-        zip(os_u, eas_u)))
-    eas_l.extend(eas_u)
-    eaps_l.extend(eaps_u)
-    eas = sorted(eas_l)
-    eaps = sorted(eaps_l)
-    ea_max = eas[-1]
-    ea_avg = sum(eas)/len(eas)
-    eas_midx = len(eas)/2
-    if len(eas)%2 == 1:
-        ea_med = eas[eas_midx]
-    else:
-        ea_med = (eas[eas_midx] + eas[eas_midx + 1])/2.
-    eap_max = eaps[-1]
-    eap_avg = sum(eaps)/len(eaps)
-    eaps_midx = len(eaps)/2
-    if len(eaps)%2 == 1:
-        eap_med = eaps[eaps_midx]
-    else:
-        eap_med = (eaps[eaps_midx] + eaps[eaps_midx + 1])/2.
-    df = pan.DataFrame(columns=[co.ERR_AMAX,
-                           co.ERR_AAVG,
-                           co.ERR_AMED,
-                           co.ERR_PMAX,
-                           co.ERR_PAVG,
-                           co.ERR_PMED])
-    df.loc[0] = [ea_max, ea_avg, ea_med, eap_max, eap_avg, eap_med]
-    return df
+    '''Compute max, mean, and median absolute and percentage errors of a model
+    as computed by the empirical shift function.'''
+    return model_errors(*stack_bands([(band_u, band_l)]))
+
+def stack_bands(bands):
+    '''Stack the bands of several models into two 2-D arrays with one row per
+    model, padded with NaN.
+
+    Parameters
+    ----------
+    bands : list of (upper band, lower band) pairs as returned by w_band()
+
+    Returns
+    -------
+    (observations, errors) as numpy.ndarray of shape (len(bands), max. number
+    of band points)
+    '''
+    lens = [len(band_u) + len(band_l) for band_u, band_l in bands]
+    obs = np.full((len(bands), max(lens + [0])), np.nan)
+    errs = np.full(obs.shape, np.nan)
+    for i, (band_u, band_l) in enumerate(bands):
+        obs[i, :lens[i]] = np.concatenate([band_l.index.values,
+            band_u.index.values])
+        errs[i, :lens[i]] = np.concatenate([band_l.values, band_u.values])
+    return obs, errs
+
+def model_errors(obs, errs, index=None):
+    '''Max, mean and median absolute and percentage errors for many models at
+    once. Percentage errors only consider positive observations. NaN entries
+    are ignored.
+
+    Parameters
+    ----------
+    obs : numpy.ndarray
+        Observations, one row per model
+    errs : numpy.ndarray
+        Errors at these observations, same shape as obs
+    index : list, optional
+        Row labels of the result
+
+    Returns
+    -------
+    pandas.DataFrame with one row per model and the columns ERR_COLUMNS
+    '''
+    obs = np.atleast_2d(np.asarray(obs, dtype=np.float64))
+    eas = np.abs(np.atleast_2d(np.asarray(errs, dtype=np.float64)))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        eaps = np.where(obs > 0, 100 * eas / obs, np.nan)
+    with warnings.catch_warnings():
+        # all-NaN rows yield NaN
+        warnings.simplefilter('ignore', RuntimeWarning)
+        stats = np.column_stack([
+            np.nanmax(eas, axis=1), np.nanmean(eas, axis=1),
+            np.nanmedian(eas, axis=1), np.nanmax(eaps, axis=1),
+            np.nanmean(eaps, axis=1), np.nanmedian(eaps, axis=1)])
+    return pan.DataFrame(stats, index=index, columns=ERR_COLUMNS)
 
 def dummy_errors():
-    return pan.Series([0.0, 0.0, 0.0, 0.0, 0.0, 0.0], 
-            index=[co.ERR_AMAX,
-                   co.ERR_AAVG,
-                   co.ERR_AMED,
-                   co.ERR_PMAX,
-                   co.ERR_PAVG,
-                   co.ERR_PMED])
+    return pan.Series([0.0, 0.0, 0.0, 0.0, 0.0, 0.0], index=ERR_COLUMNS)
 
 def emp_shift_qf(x_cdf, y_cdf):
     '''Compute the empirical shift function 
     $\hat{Delta}(x) = G^{-1}(F(x)) - x$ following [Doksum 1796]
     See http://projecteuclid.org/euclid.aos/1176342662 
-    or http://biomet.oxfordjournals.org/content/63/3/421.short'''
+    or http://biomet.oxfordjournals.org/content/63/3/421.short
 
-    shifts = list()
-    #for x in x_cdf.index.values:
-    for i in range(len(x_cdf)):
-        s = get_quantile(y_cdf, x_cdf.iget(i)) - x_cdf.index[i]
-        shifts.append(s)
-    return (x_cdf.index.values, shifts)
+    x_cdf and y_cdf are outcomes of get_cdf() or ECDFs.'''
+    x_ecdf = as_ecdf(x_cdf)
+    shifts = as_ecdf(y_cdf).quantile(x_ecdf.ps) - x_ecdf.xs
+    return (x_ecdf.xs, shifts)
 
 def emp_shift_os(sample_x, sample_y):
-    '''Estimator for $\Delta$ using order statistics following [Doksum 1977]'''
-    xs = sorted(sample_x)
-    ys = sorted(sample_y)
-    m = len(xs)
-    n = float(len(ys))
-    shifts = list()
-    for i in range(1, m + 1):
-        y_idx = int(np.ceil(i * n/m)) - 1
-        try:
-            d = ys[y_idx] - xs[i - 1]
-        except:
-            print m, n, i, y_idx
-        shifts.append(d)
+    '''Estimator for $\Delta$ using order statistics following [Doksum 1977]
 
-    assert len(xs) == len(shifts)
+    Returns
+    -------
+    (sorted sample_x, shifts) as numpy.ndarrays
+    '''
+    xs = np.sort(np.asarray(sample_x), kind='mergesort')
+    ys = np.sort(np.asarray(sample_y), kind='mergesort')
+    m = len(xs)
+    n = len(ys)
+    #y_idx = ceil(i * n/m) - 1 for i = 1..m, in integer arithmetic
+    y_idxs = (np.arange(1, m + 1) * n + m - 1) // m - 1
+    shifts = ys[y_idxs] - xs
     return (xs, shifts)
 
 def h(u, m, n, k):
@@ -238,90 +539,343 @@ def h(u, m, n, k):
     d = 1 + c * nlsq
     return num_u/d, num_l/d
 
-def w_band(sample_x, sample_y, a=0.1, alpha=0.02):
-    '''W confidence band for $\Delta(x)$ taken from [Doksum 1977].'''
-    xs = sorted(set(sample_x))
+def w_band(sample_x, sample_y, a=0.1, alpha=0.02, presorted=False):
+    '''W confidence band for $\Delta(x)$ taken from [Doksum 1977].
+
+    Parameters
+    ----------
+    sample_x, sample_y : array-like
+    a, alpha : float
+        Band range and significance level, see co.W_BAND_K_e and 
+        co.W_BAND_K
+    presorted : bool
+        If True, the samples are taken as outcomes of w_band_prepare(), e.g.
+        to compute several bands for the same observed sample without sorting
+        it again.
+
+    Returns
+    -------
+    (upper band, lower band) as pandas.Series indexed by x
+    '''
+    if presorted:
+        xs, ys = np.asarray(sample_x), np.asarray(sample_y)
+    else:
+        xs, ys = w_band_prepare(sample_x), w_band_prepare(sample_y)
     m = float(len(xs))
-    ys = sorted(set(sample_y))
     n = float(len(ys))
     valid_ns = range(5,51)
     valid_ns.extend(range(60,101,10))
-    if n in valid_ns:
+    if int(n) in valid_ns:
         try:
-            k = co.W_BAND_K_e[a][alpha][n]
-        except:
-            raise NotImplementedError, 'critical value for a {0}, alpha {1}, n {2} \
-                not defined'.format(a, alpha, n)
+            k = co.W_BAND_K_e[a][alpha][int(n)]
+        except KeyError:
+            raise NotImplementedError, 'critical value for a {0}, alpha {1}, \
+                n {2} not defined'.format(a, alpha, n)
     else:
         try:
-            c = co.W_BAND_K[a][alpha]
-        except:
+            k = co.W_BAND_K[a][alpha]
+        except KeyError:
             raise NotImplementedError, 'Approximate critical value for alpha \
-                    {0} and a {1] not defined'.format(alpha, a)
+                    {0} and a {1} not defined'.format(alpha, a)
     b = 1 - a
     r = int(np.floor(m * a))
     s = int(np.floor(m * b)) - 1 #+1 to simplify notation afterwards
-    d_us, d_ls = list(), list()
-    z = s - r
-    idxs_l = list()
-    idxs_u = list()
-    for i in range(r, s):
-        h_u, h_l = h((i+1)/m, m, n, k)
-        if h_l >= 0. and h_l <= 1.: 
-            idxs_l.append(i)
-            #Keep in mind that in Doksum1977 the indices start at 1, but ours 
-            #at 0. Thus, $\lceil x \rceil \rightarrow$ floor(x), and 
-            #$\lfloor x \rfloor + 1 \rightarrow$ floor(x)
-            i_l = int( np.floor(n * h_l) )
-            if i_l >= 0: 
-                y_l = ys[i_l]
-                d_ls.append(y_l - xs[i - 1])
-            else:
-                d_ls.append(-np.inf)
-        if h_u >= 0. and h_u <= 1.: 
-            idxs_u.append(i)
-            i_u = int( np.floor(n * h_u) )
-            if i_u <= n: 
-                y_u = ys[i_u]
-                d_us.append(y_u - xs[i - 1])
-            else:
-                d_us.append(np.inf)
-    d_l_idxs = list()
-    for idx in idxs_l:
-        d_l_idxs.append(xs[idx])
-    try:
-        d_l = pan.Series(d_ls, index=d_l_idxs)
-    except:
+    idxs = np.arange(r, max(r, s))
+    h_us, h_ls = h((idxs + 1) / m, m, n, k)
+    #Keep in mind that in Doksum1977 the indices start at 1, but ours 
+    #at 0. Thus, $\lceil x \rceil \rightarrow$ floor(x), and 
+    #$\lfloor x \rfloor + 1 \rightarrow$ floor(x)
+    in_l = (h_ls >= 0.) & (h_ls <= 1.)
+    idxs_l = idxs[in_l]
+    i_ls = np.floor(n * h_ls[in_l]).astype(np.int64)
+    d_ls = np.full(len(idxs_l), -np.inf)
+    ok = i_ls >= 0
+    d_ls[ok] = ys[i_ls[ok]] - xs[idxs_l[ok]]
+
+    in_u = (h_us >= 0.) & (h_us <= 1.)
+    idxs_u = idxs[in_u]
+    i_us = np.floor(n * h_us[in_u]).astype(np.int64)
+    d_us = np.full(len(idxs_u), np.inf)
+    ok = i_us < n
+    d_us[ok] = ys[i_us[ok]] - xs[idxs_u[ok]]
+
+    if len(d_ls) == 0:
         print 'WARNING: no valid lower band'
-        d_l = pan.Series([])
-    d_u_idxs = list()
-    for idx in idxs_u:
-        d_u_idxs.append(xs[idx])
-    try:
-        d_u = pan.Series(d_us, index=d_u_idxs)
-    except:
+    if len(d_us) == 0:
         print 'WARNING: no valid upper band'
-        d_u = pan.Series([])
+    d_l = pan.Series(d_ls, index=xs[idxs_l])
+    d_u = pan.Series(d_us, index=xs[idxs_u])
     return d_u, d_l
 
+def w_band_prepare(sample):
+    '''Sorted unique values of a sample as used by w_band()'''
+    vals = np.asarray(sample)
+    return np.unique(vals[~pan.isnull(vals)])
+
 def s_band():
     pass
 
 
+class ECDF(object):
+    '''Empirical CDF as two contiguous arrays: the sorted unique values xs
+    and their cumulative probabilities ps. CDF and quantile queries are
+    answered in batch by binary search. pandas.Series in the layouts of
+    get_cdf() and get_inv_cdf() are only built on demand, e.g. for plotting.
+
+    Parameters
+    ----------
+    xs : array-like, sorted unique values
+    ps : array-like, cumulative probabilities of xs
+    name : string
+    '''
+    def __init__(self, xs, ps, name=None):
+        self._xs = np.ascontiguousarray(xs)
+        self._ps = np.ascontiguousarray(ps, dtype=np.float64)
+        self._name = name
+
+    @classmethod
+    def from_series(cls, series, decimals=6):
+        '''ECDF of the numeric pandas.Series, sorted once. NaNs are dropped
+        but count towards the number of samples, as in get_cdf().'''
+        vals = series.values
+        vals = np.sort(vals[~pan.isnull(vals)], kind='mergesort')
+        uniq, ends = sorted_unique(vals)
+        ps = _round(ends / float(len(series)), decimals)
+        return cls(uniq, ps, series.name)
+
+    @property
+    def xs(self):
+        return self._xs
+
+    @property
+    def ps(self):
+        return self._ps
+
+    @property
+    def name(self):
+        return self._name
+
+    def __len__(self):
+        return len(self.xs)
+
+    def cdf(self, x):
+        '''Pr[X <= x] for a scalar or an array x'''
+        idx = np.searchsorted(self.xs, x, side='right')
+        return np.where(idx > 0, self.ps[np.maximum(idx - 1, 0)], 0.)
+
+    def quantile(self, p):
+        '''Smallest x with Pr[X <= x] >= p for a scalar or an array p'''
+        idx = np.searchsorted(self.ps, p, side='left')
+        return self.xs[np.minimum(idx, len(self.xs) - 1)]
+
+    def to_series(self):
+        '''pandas.Series value -> probability, as get_cdf()'''
+        cdf = pan.Series(self.ps, index=self.xs)
+        cdf.name = self.name
+        return cdf
+
+    def to_inv_series(self):
+        '''pandas.Series probability -> value, as get_inv_cdf()'''
+        cdf_inv = pan.Series(self.xs.astype(np.float64), index=self.ps)
+        cdf_inv.name = self.name
+        return cdf_inv
+
+
+class QuantileSketch(object):
+    '''Mergeable quantile sketch with bounded relative error, following the
+    DDSketch approach [Masson 2019]. Values are counted in logarithmically
+    sized buckets, so every quantile is returned within rel_acc relative
+    error of the exact one while memory only grows with the logarithm of the
+    value range. Sketches built from chunks, files, hosts or testsets merge
+    by adding bucket counts.
+
+    Parameters
+    ----------
+    rel_acc : float
+        Relative accuracy of quantiles, e.g. 0.01 for 1%
+    name : string
+    '''
+    min_value = 1e-9 # smaller magnitudes are counted as zero
+
+    def __init__(self, rel_acc=0.01, name=None):
+        assert 0. < rel_acc < 1.
+        self._rel_acc = rel_acc
+        self._gamma = (1. + rel_acc) / (1. - rel_acc)
+        self._lg = np.log(self._gamma)
+        self._name = name
+        self._pos = (np.array([], dtype=np.int64), np.array([], 
+            dtype=np.int64))
+        self._neg = (np.array([], dtype=np.int64), np.array([], 
+            dtype=np.int64))
+        self._zeros = 0
+        self._moments = (0, 0., 0.)
+        self._min = np.inf
+        self._max = -np.inf
+
+    @property
+    def rel_acc(self):
+        return self._rel_acc
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def count(self):
+        return self._moments[0]
+
+    @property
+    def min(self):
+        return self._min
+
+    @property
+    def max(self):
+        return self._max
+
+    @property
+    def mean(self):
+        return self._moments[1] if self.count else np.nan
+
+    @property
+    def std(self):
+        n, mean, m2 = self._moments
+        return np.sqrt(m2 / (n - 1)) if n > 1 else np.nan
+
+    def add(self, values):
+        '''Add an array or pandas.Series of values, NaNs are ignored.'''
+        if self.name is None:
+            self._name = getattr(values, 'name', None)
+        vals = np.asarray(values, dtype=np.float64)
+        vals = vals[~np.isnan(vals)]
+        if len(vals) == 0:
+            return self
+        self._moments = merge_moments(self._moments, moments(vals))
+        self._min = min(self._min, vals.min())
+        self._max = max(self._max, vals.max())
+        mags = np.abs(vals)
+        self._zeros += int((mags < self.min_value).sum())
+        self._pos = _merge_buckets(self._pos, 
+                self._bucket_counts(vals[vals >= self.min_value]))
+        self._neg = _merge_buckets(self._neg, 
+                self._bucket_counts(-vals[vals <= -self.min_value]))
+        return self
+
+    def merge(self, other):
+        '''Add the counts of another QuantileSketch of equal rel_acc.'''
+        assert other.rel_acc == self.rel_acc
+        self._moments = merge_moments(self._moments, other._moments)
+        self._min = min(self._min, other._min)
+        self._max = max(self._max, other._max)
+        self._zeros += other._zeros
+        self._pos = _merge_buckets(self._pos, other._pos)
+        self._neg = _merge_buckets(self._neg, other._neg)
+        return self
+
+    def _bucket_counts(self, mags):
+        keys = np.ceil(np.log(mags) / self._lg).astype(np.int64)
+        keys, counts = np.unique(keys, return_counts=True)
+        return keys, counts.astype(np.int64)
+
+    def _values_and_counts(self):
+        '''Representative values of all buckets in ascending order.'''
+        nkeys, ncounts = self._neg
+        pkeys, pcounts = self._pos
+        rep = lambda keys: 2. * self._gamma ** keys / (self._gamma + 1.)
+        xs = np.concatenate([-rep(nkeys[::-1]), [0.], rep(pkeys)])
+        counts = np.concatenate([ncounts[::-1], [self._zeros], pcounts])
+        keep = counts > 0
+        xs = np.clip(xs[keep], self.min, self.max)
+        return xs, counts[keep]
+
+    def to_ecdf(self):
+        '''ECDF over the bucket values, e.g. for plotting or for
+        estimate_quantiles()'''
+        assert self.count > 0
+        xs, counts = self._values_and_counts()
+        return ECDF(xs, counts.cumsum() / float(self.count), self.name)
+
+    def quantile(self, p):
+        '''Quantiles for a scalar or an array p, each within rel_acc
+        relative error'''
+        return self.to_ecdf().quantile(p)
+
+    def cdf(self, x):
+        '''Approximate Pr[X <= x] for a scalar or an array x'''
+        return self.to_ecdf().cdf(x)
+
+    def describe(self, percentiles=[.25, .5, .75]):
+        '''Summary in the layout of pandas.Series.describe()'''
+        index = ['count', 'mean', 'std', 'min']
+        vals = [self.count, self.mean, self.std, self.min]
+        if self.count:
+            quants = self.quantile(percentiles)
+        else:
+            quants = np.full(len(percentiles), np.nan)
+        for p, q in zip(percentiles, quants):
+            index.append('%g%%' % (100 * p))
+            vals.append(q)
+        index.append('max')
+        vals.append(self.max)
+        summ = pan.Series(vals, index=index)
+        summ.name = self.name
+        return summ
+
+
+def build_sketch(chunks, rel_acc=0.01, name=None):
+    '''QuantileSketch of a sequence of pandas.Series, e.g. one column of
+    logreaders.DstatLogReader.iter_chunks(), holding one chunk at a time.'''
+    sketch = QuantileSketch(rel_acc, name)
+    for chunk in chunks:
+        sketch.add(chunk)
+    return sketch
+
+def _merge_buckets(a, b):
+    keys = np.concatenate([a[0], b[0]])
+    if len(keys) == 0:
+        return a
+    keys, inv = np.unique(keys, return_inverse=True)
+    counts = np.bincount(inv, weights=np.concatenate([a[1], b[1]]))
+    return keys, counts.astype(np.int64)
+
+def moments(series):
+    '''count, mean and sum of squared deviations of the non-NaN values'''
+    vals = np.asarray(series, dtype=np.float64)
+    vals = vals[~np.isnan(vals)]
+    if len(vals) == 0:
+        return 0, 0., 0.
+    mean = vals.mean()
+    return len(vals), mean, ((vals - mean) ** 2).sum()
+
+def merge_moments(a, b):
+    '''Combine (count, mean, sum of squared deviations) of two samples,
+    see [Chan 1979]'''
+    na, mean_a, m2_a = a
+    nb, mean_b, m2_b = b
+    n = na + nb
+    if n == 0:
+        return a
+    delta = mean_b - mean_a
+    mean = mean_a + delta * nb / float(n)
+    m2 = m2_a + m2_b + delta * delta * na * nb / float(n)
+    return n, mean, m2
+
+
 class Sample(object):
     def __init__(self, data):
         self._sample = pan.Series(data)
-        self._cdf = get_cdf(self.sample)
+        self._ecdf = ECDF.from_series(self.sample)
 
     @property
-    def sample():
+    def sample(self):
         return self._sample
 
     @property
-    def cdf():
-        return self._cdf
+    def ecdf(self):
+        return self._ecdf
 
-    def quantile(p):
-        idx = bisect.bisect_left(self.cdf.values, p)
-        return self.cdf.index[idx]
+    @property
+    def cdf(self):
+        return self.ecdf.to_series()
 
+    def quantile(self, p):
+        return self.ecdf.quantile(p)
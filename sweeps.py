@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+
+import multiprocessing as mp
+
+import numpy as np
+import pandas as pan
+
+import constants as co
+import stats_helper as shelp
+import logwriters as writing
+from evaluators import EDFRegressionEvaluator, fitted_cdf
+
+RESULT_COLUMNS = ['response', 'formula', 'reg', 'steps', 'lag', 'result'] + \
+        shelp.ERR_COLUMNS
+
+# set per worker process by _init_worker()
+_responses = None
+_predictors = None
+
+
+def expand_sweep(task, kind, lags=(0,), steps=(30,),
+        regs=(co.REGR_OLS, co.REGR_GLSAR), combi=True):
+    '''Jobs of a model sweep: every predictor set of constants.PREDS (and
+    constants.COMBIPREDS if combi) for task, e.g. co.DLK, and kind, i.e.
+    co.RUK, co.PWRK or co.WLK, times lags, steps and regression types.
+    Duplicates are dropped.
+
+    Returns
+    -------
+    list of (predictor columns, right hand side of the formula, lag, steps,
+    regression type)
+    '''
+    predsets = list(co.PREDS.get(task, {}).get(kind, []))
+    if combi:
+        predsets.extend(co.COMBIPREDS.get(task, {}).get(kind, []))
+    jobs = list()
+    seen = set()
+    for colns, rhs in predsets:
+        for step in steps:
+            for lag in lags:
+                for reg in regs:
+                    job = (tuple(colns), rhs, lag, step, reg)
+                    if job not in seen:
+                        seen.add(job)
+                        jobs.append(job)
+    return jobs
+
+def _init_worker(responses, predictors):
+    global _responses, _predictors
+    _responses = responses
+    _predictors = predictors
+
+def _model_errors(res, resp_ser, pred):
+    try:
+        fit_cdf = fitted_cdf(res, resp_ser, pred)
+        w_band_u, w_band_l = shelp.w_band(resp_ser,
+                shelp.rvs_from_cdf(fit_cdf, size=len(resp_ser)))
+        return shelp.model_errors_by_shiftfun(w_band_u, w_band_l).values[0]
+    except NotImplementedError, err:
+        print 'WARNING: model errors of', resp_ser.name, 'skipped.', err
+        return np.full(len(shelp.ERR_COLUMNS), np.nan)
+
+def _run_job(job):
+    '''Fit one predictor set for all responses at once, thus the predictor
+    quantiles are estimated once per job'''
+    colns, rhs, lag, steps, reg = job
+    pred_df = _predictors[list(colns)]
+    pred = pred_df[colns[0]] if len(colns) == 1 else pred_df
+    ere = EDFRegressionEvaluator(steps)
+    rows = list()
+    fits = ere.fit_models(rhs, _responses, pred_df, lag, reg)
+    for resp_ser, (res, formula) in zip(_responses, fits):
+        if res is None:
+            continue
+        errs = _model_errors(res, resp_ser, pred)
+        rows.append([resp_ser.name, formula, reg, steps, lag, res] +
+                list(errs))
+    return rows
+
+def run_sweep(responses, predictors, jobs, processes=None):
+    '''Fit all jobs of expand_sweep() in a process pool of processes workers
+    (default: number of cores). Fitting is kept apart from plotting and file
+    writes, see write_sweep().
+
+    Parameters
+    ----------
+    responses : dict name -> pandas.Series or MeasurementDataContainer
+    predictors : pandas.DataFrame
+        Keeps all predictor columns used by the jobs
+
+    Returns
+    -------
+    pandas.DataFrame with RESULT_COLUMNS, one row per job and response
+    '''
+    if hasattr(responses, 'mds'):
+        responses = dict((name, md.series) for name, md in
+                responses.mds.items())
+    resp_sers = list()
+    for name, ser in sorted(responses.items()):
+        std = np.nan if ser is None else ser.std()
+        if np.isnan(std) or np.round(std, decimals=5) == 0.:
+            print 'WARNING: modeling', name, 'skipped. Appears empty or \
+                    constant.'
+            continue
+        resp_sers.append(ser)
+    if processes == 1 or len(jobs) < 2:
+        _init_worker(resp_sers, predictors)
+        try:
+            results = map(_run_job, jobs)
+        finally:
+            _init_worker(None, None)
+            EDFRegressionEvaluator.quantile_cache.clear()
+    else:
+        pool = mp.Pool(processes, _init_worker, (resp_sers, predictors))
+        try:
+            results = pool.map(_run_job, jobs, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    rows = [row for job_rows in results for row in job_rows]
+    return pan.DataFrame(rows, columns=RESULT_COLUMNS)
+
+def write_sweep(table, tpath, test=''):
+    '''Write regression summaries and model errors of a run_sweep() table
+    with logwriters.ResultsWriter'''
+    for _, row in table.iterrows():
+        res_writer = writing.ResultsWriter(tpath, row['formula'], test,
+                row['result'], row['lag'], row['reg'], row['steps'])
+        res_writer.write_regr_summ()
+        res_writer.write_model_errors(row[shelp.ERR_COLUMNS].to_frame().T)